@@ -0,0 +1,260 @@
+"""
+Headless batch runner for generating dialogue datasets
+Reads a JSONL file of conversation jobs, runs them concurrently without any typing effect and
+writes each dialogue to the output as soon as it completes. Re-running with the same output
+skips the jobs that already finished.
+
+Each job line uses the fields of ImprovedConversationConfig plus an optional "id":
+    {"id": "space-001", "model1": "qwen2:1.5b", "model2": "llama3.2:1b", "turns": 6,
+     "model1_context": "You are an astronaut...", "model2_context": "You are a student..."}
+    {"participants": [{"name": "Ada", "model": "qwen2:1.5b", "context": "You are Ada..."}, ...],
+     "turn_policy": "addressed", "turns": 4}
+
+    python batch_runner.py jobs.jsonl -o dialogues.jsonl --concurrency 8 --model-concurrency 2
+    python batch_runner.py jobs.jsonl -o dialogues/ --format parquet   # needs pyarrow
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sys
+import time
+from typing import Iterator, List, Set
+
+from conversation import Conversation, ImprovedConversationConfig
+from inference import InferenceClient, parse_backends, parse_model_limits
+from response_cache import create_response_cache
+
+logger = logging.getLogger(__name__)
+
+
+def read_jobs(path: str) -> Iterator[dict]:
+    """Yield jobs from a JSONL file, giving each one a stable id"""
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            if "id" not in job:
+                # Stable across runs so that resuming works without explicit ids
+                job["id"] = hashlib.sha1(line.encode()).hexdigest()[:16]
+            job["id"] = str(job["id"])
+            yield job
+
+
+class JsonlSink:
+    """Appends one JSON line per finished dialogue"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def completed_ids(self) -> Set[str]:
+        ids = set()
+        if not os.path.exists(self.path):
+            return ids
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by an interrupted run
+                if not record.get("error"):
+                    ids.add(record["id"])
+        return ids
+
+    def open(self):
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetSink:
+    """Writes finished dialogues as Parquet part files in a dataset directory
+
+    Dialogues are buffered until a part file holds `rows_per_file` of them, since Parquet files
+    cannot be appended to; a run that is killed loses at most the buffered ones.
+    """
+
+    def __init__(self, path: str, rows_per_file: int = 10):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("Parquet output needs pyarrow: pip install pyarrow") from e
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_file = max(1, rows_per_file)
+        self._rows: List[dict] = []
+        self._run = time.strftime("%Y%m%d-%H%M%S")
+        self._part = 0
+
+    def completed_ids(self) -> Set[str]:
+        ids = set()
+        if not os.path.isdir(self.path):
+            return ids
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith(".parquet"):
+                table = self._pq.read_table(os.path.join(self.path, name), columns=["id", "error"])
+                ids.update(i for i, error in zip(table.column("id").to_pylist(),
+                                                 table.column("error").to_pylist()) if not error)
+        return ids
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def write(self, record: dict):
+        self._rows.append(dict(record, error=record.get("error")))
+        if len(self._rows) >= self.rows_per_file:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        table = self._pa.Table.from_pylist(self._rows)
+        # A resumed run may start within the same second as the one it resumes
+        path = os.path.join(self.path, f"part-{self._run}-{self._part:05d}.parquet")
+        while os.path.exists(path):
+            self._part += 1
+            path = os.path.join(self.path, f"part-{self._run}-{self._part:05d}.parquet")
+        self._pq.write_table(table, path)
+        self._part += 1
+        self._rows = []
+
+    def close(self):
+        self._flush()
+
+
+async def run_dialogue(client: InferenceClient, job: dict) -> dict:
+    """Run one conversation headlessly and return it as an output record"""
+    config = ImprovedConversationConfig(**{k: v for k, v in job.items() if k != "id"})
+    dialogue = Conversation.from_config(client, config, stream=False)
+    started = time.perf_counter()
+    record = {"id": job["id"], "model1": config.model1, "model2": config.model2, "turns": config.turns}
+    if config.participants:
+        record = {"id": job["id"], "participants": [p.dict() for p in config.participant_configs()],
+                  "turn_policy": config.turn_policy, "turns": config.turns}
+    transcript = []
+    dialogue.start()
+    try:
+        async for turn in dialogue:
+            async for _ in turn.pieces():
+                pass
+            response = turn.response or {}
+            transcript.append({
+                "turn": turn.number,
+                "model": turn.model,
+                "speaker": turn.speaker.name,
+                "content": turn.content,
+                "prompt_tokens": response.get('prompt_eval_count') or 0,
+                "completion_tokens": response.get('eval_count') or 0,
+                "cached": turn.cached,
+            })
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        dialogue.cancel()
+    record["transcript"] = transcript
+    record["prompt_tokens"] = sum(t["prompt_tokens"] for t in transcript)
+    record["completion_tokens"] = sum(t["completion_tokens"] for t in transcript)
+    record["duration_s"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+async def run_batch(jobs: List[dict], sink, client: InferenceClient, concurrency: int, progress=True):
+    """Run jobs through a pool of workers, writing each result as it completes"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for job in jobs:
+        queue.put_nowait(job)
+    totals = {"completed": 0, "failed": 0, "completion_tokens": 0, "prompt_tokens": 0}
+
+    async def worker():
+        while True:
+            try:
+                job = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            try:
+                record = await run_dialogue(client, job)
+            except Exception as e:
+                # Invalid job definitions end up here
+                record = {"id": job["id"], "error": f"{type(e).__name__}: {e}", "transcript": []}
+            sink.write(record)
+            totals["failed" if record.get("error") else "completed"] += 1
+            totals["completion_tokens"] += record.get("completion_tokens", 0)
+            totals["prompt_tokens"] += record.get("prompt_tokens", 0)
+            if progress:
+                status = f"failed: {record['error']}" if record.get("error") else f"{record['duration_s']}s"
+                print(f"[{totals['completed'] + totals['failed']}/{len(jobs)}] {job['id']} {status}", file=sys.stderr)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate dialogues headlessly from a JSONL file of jobs")
+    parser.add_argument("jobs", help="JSONL file with one conversation config per line")
+    parser.add_argument("-o", "--output", required=True, help="output JSONL file, or directory for --format parquet")
+    parser.add_argument("--format", choices=["jsonl", "parquet"], default="jsonl")
+    parser.add_argument("--rows-per-file", type=int, default=10,
+                        help="dialogues per Parquet part file; 1 writes each one as soon as it finishes")
+    parser.add_argument("--concurrency", type=int, default=4, help="dialogues running at once")
+    parser.add_argument("--model-concurrency", type=int, default=2, help="generations per model at once")
+    parser.add_argument("--model-limits", help='per-model overrides, e.g. "qwen2:1.5b=1,llama3.2:1b=4"')
+    parser.add_argument("--host", help="Ollama host (defaults to OLLAMA_HOST)")
+    parser.add_argument("--backends", help='several Ollama hosts to balance between, e.g. '
+                                           '"http://gpu1:11434 max=4; http://gpu2:11434 max=2"')
+    parser.add_argument("--response-cache", help="reuse replies to identical prompts: memory or sqlite:///path "
+                                                 "(defaults to AITALK_RESPONSE_CACHE)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    sink = ParquetSink(args.output, args.rows_per_file) if args.format == "parquet" else JsonlSink(args.output)
+    done = sink.completed_ids()
+    jobs = [job for job in read_jobs(args.jobs) if job["id"] not in done]
+    print(f"{len(jobs)} jobs to run, {len(done)} already completed", file=sys.stderr)
+
+    response_cache = create_response_cache(args.response_cache)
+    client = InferenceClient(host=args.host, model_concurrency=args.model_concurrency,
+                             model_limits=parse_model_limits(args.model_limits), response_cache=response_cache,
+                             backends=parse_backends(args.backends) if args.backends else None)
+
+    async def run():
+        client.start()
+        try:
+            return await run_batch(jobs, sink, client, args.concurrency)
+        finally:
+            await client.aclose()
+
+    sink.open()
+    started = time.perf_counter()
+    try:
+        totals = asyncio.run(run())
+    finally:
+        sink.close()
+        if response_cache is not None:
+            response_cache.close()
+    elapsed = time.perf_counter() - started
+
+    print("=" * 50)
+    print(f"dialogues completed: {totals['completed']} ({totals['failed']} failed) in {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"throughput:          {totals['completed'] / elapsed * 60:.1f} dialogues/min, "
+              f"{totals['completion_tokens'] / elapsed:.1f} generated tokens/s")
+    if response_cache is not None:
+        stats = response_cache.stats()
+        print(f"response cache:      {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate)")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    main()
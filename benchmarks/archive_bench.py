@@ -0,0 +1,114 @@
+"""
+Transcript archive throughput and browsing latency
+Archives N synthetic conversations, then measures how long appending takes on the caller's side,
+flush throughput, first-page and deep-page listing, full-text search, single transcript export
+and bulk export, so browsing a large archive can be checked for slowdowns.
+
+    python benchmarks/archive_bench.py --conversations 5000 --turns 20 --output archive.json
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import format_stats, percentiles, rss_bytes, save_results  # noqa: E402
+from transcript_archive import TranscriptArchive  # noqa: E402
+
+# A few thousand words with Zipf-like frequencies, so searches match a realistic share of turns
+WORDS = ("orbit science floating moon sunrise stars crew station launch space earth silence rocket window "
+         "gravity mission telescope comet planet nebula engine helmet oxygen module docking").split()
+WORDS += [f"word{n}" for n in range(5000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+
+def timed(fn, repeat=20):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the transcript archive")
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--directory", help="archive directory (default: a temporary one)")
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = TranscriptArchive(args.directory or tmp)
+        archive.start()
+        ids = [f"bench-{n:06d}" for n in range(args.conversations)]
+        appends = []
+        started = time.perf_counter()
+        for conversation_id in ids:
+            archive.start_conversation(conversation_id, {"turns": args.turns},
+                                       [{"name": "Astronaut", "model": "qwen2:1.5b"},
+                                        {"name": "Student", "model": "llama3.2:1b"}])
+            for index in range(args.turns):
+                content = " ".join(rng.choices(WORDS, WEIGHTS, k=args.reply_words))
+                t = time.perf_counter()
+                archive.add_turn(conversation_id, index, index // 2 + 1, index % 2, "Astronaut", "qwen2:1.5b",
+                                 content, {"completion_tokens": args.reply_words})
+                # Microseconds, since percentiles() rounds to four decimals
+                appends.append((time.perf_counter() - t) * 1e6)
+            archive.end_conversation(conversation_id, "completed")
+        archive.flush()
+        write_s = time.perf_counter() - started
+        records = args.conversations * (args.turns + 2)
+
+        # Keyset pagination: the last page (the oldest 50) should cost the same as the first
+        list_first = timed(lambda: archive.list_conversations(limit=50))
+        list_deep = timed(lambda: archive.list_conversations(before=51, limit=50))
+        search = timed(lambda: archive.search(" ".join(rng.sample(WORDS[:200], 2)), 20))
+        transcript = timed(lambda: sum(len(line) for line in archive.iter_turns(rng.choice(ids))))
+        rss_before_export = (rss_bytes(os.getpid()) or 0) / 2**20
+        started = time.perf_counter()
+        exported = 0
+        rss_during_export = rss_before_export
+        for chunk in archive.iter_log():
+            exported += len(chunk)
+            rss_during_export = max(rss_during_export, (rss_bytes(os.getpid()) or 0) / 2**20)
+        export_s = time.perf_counter() - started
+        stats = archive.stats()
+        archive.close()
+
+    summary = {
+        "conversations": args.conversations,
+        "records": records,
+        "log_mb": round(stats["log_bytes"] / 2**20, 1),
+        "append_us": percentiles(appends),
+        "write_records_per_s": round(records / write_s),
+        "list_first_page_s": list_first,
+        "list_deep_page_s": list_deep,
+        "search_s": search,
+        "transcript_export_s": transcript,
+        "bulk_export_mb_per_s": round(exported / 2**20 / export_s, 1),
+        "rss_mb": {"before_export": round(rss_before_export, 1), "during_export": round(rss_during_export, 1)},
+    }
+    print(f"archived:             {args.conversations} conversations, {records} records, {summary['log_mb']} MB log")
+    print(f"append (caller side): {format_stats(summary['append_us'], 1, 'µs', 1)}")
+    print(f"generate + archive:   {summary['write_records_per_s']} records/s")
+    print(f"list, first page:     {format_stats(list_first, digits=2)}")
+    print(f"list, last page:      {format_stats(list_deep, digits=2)}")
+    print(f"search:               {format_stats(search, digits=2)}")
+    print(f"transcript export:    {format_stats(transcript, digits=2)}")
+    print(f"bulk export:          {summary['bulk_export_mb_per_s']} MB/s")
+    print(f"memory:               {rss_before_export:.1f} MB before export, at most {rss_during_export:.1f} MB during")
+    if args.output:
+        save_results(args.output, "archive_bench", vars(args), summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Compare two benchmark result files
+Prints every numeric result of both runs side by side with the relative change, e.g. to check a
+branch against main:
+
+    git checkout main && python benchmarks/load_test.py --output before.json
+    git checkout my-branch && python benchmarks/load_test.py --output after.json
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.report import flatten  # noqa: E402
+
+
+def load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("before")
+    parser.add_argument("after")
+    parser.add_argument("--threshold", type=float, default=10.0,
+                        help="mark changes larger than this many percent")
+    args = parser.parse_args()
+
+    before, after = load(args.before), load(args.after)
+    if before.get("benchmark") != after.get("benchmark"):
+        print(f"warning: comparing {before.get('benchmark')} with {after.get('benchmark')}")
+    changed = {key for key in set(before["settings"]) | set(after["settings"])
+               if key != "output" and before["settings"].get(key) != after["settings"].get(key)}
+    if changed:
+        print(f"warning: settings differ: {', '.join(sorted(changed))}")
+    print(f"{'':36s} {before.get('commit') or args.before:>12s} {after.get('commit') or args.after:>12s}")
+
+    old, new = flatten(before["results"]), flatten(after["results"])
+    for key in sorted(set(old) | set(new)):
+        a, b = old.get(key), new.get(key)
+        change = ""
+        if a is not None and b is not None and a:
+            percent = (b - a) / abs(a) * 100
+            change = f"{percent:+7.1f}%" + (" *" if abs(percent) >= args.threshold else "")
+        print(f"{key:36s} {'-' if a is None else f'{a:g}':>12s} {'-' if b is None else f'{b:g}':>12s} {change}")
+
+
+if __name__ == "__main__":
+    main()
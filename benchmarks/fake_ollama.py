@@ -0,0 +1,286 @@
+"""
+Fake Ollama server for benchmarks and load tests
+Implements just enough of the Ollama HTTP API (/api/tags, /api/chat, /api/generate, /api/ps)
+to drive AiTalkDual without real models. Replies are deterministic and generated at a fixed speed;
+with a failure rate, a seeded random sequence of requests fails with HTTP 500.
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ("space", "orbit", "station", "gravity", "stars", "rocket", "moon", "earth",
+         "science", "launch", "mission", "crew", "window", "sunrise", "silence", "floating")
+
+
+class FakeOllamaState:
+    """Settings and bookkeeping shared by all request handlers"""
+
+    def __init__(self, models, tokens_per_second=50.0, reply_tokens=40, load_delay=0.0,
+                 prompt_tokens_per_second=0.0, max_loaded=0, failure_rate=0.0, seed=0):
+        self.models = list(models)
+        self.tokens_per_second = tokens_per_second
+        # Prompt processing speed; 0 makes prompt evaluation free regardless of history length
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.load_delay = load_delay
+        # Simulates a crashed host: connections are dropped without a response
+        self.down = False
+        # Fraction of generation requests answered with an error; seeded so runs are repeatable
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.failures = 0
+        # Models in memory, least recently used first; 0 keeps every model loaded
+        self.max_loaded = max_loaded
+        self.loaded = OrderedDict()
+        self.loading = set()
+        self.pending = deque()
+        self.running = Counter()
+        self.loads = 0
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.requests = 0
+        self.active = 0
+        self.max_active = 0
+
+    def begin(self):
+        with self.lock:
+            self.requests += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+
+    def end(self):
+        with self.lock:
+            self.active -= 1
+
+    def load(self, model):
+        """Return the simulated load time for model, loading it if needed
+
+        Requests are admitted in arrival order, as by Ollama's scheduler: one waiting for a model
+        to load holds up those behind it. With max_loaded, only a model with no running requests
+        can be evicted to make room, as with OLLAMA_MAX_LOADED_MODELS.
+        """
+        ticket = object()
+        with self.changed:
+            self.pending.append(ticket)
+            while True:
+                if self.pending[0] is ticket:
+                    cold = model not in self.loaded
+                    if not cold:
+                        break
+                    if model not in self.loading and (not self.max_loaded or self._make_room()):
+                        self.loading.add(model)
+                        self.loads += 1
+                        break
+                self.changed.wait()
+            self.pending.popleft()
+            self.changed.notify_all()
+            if not cold:
+                self.loaded.move_to_end(model)
+                self.running[model] += 1
+                return 0.0
+        if self.load_delay:
+            time.sleep(self.load_delay)
+        with self.changed:
+            self.loading.discard(model)
+            self.loaded[model] = True
+            self.running[model] += 1
+            self.changed.notify_all()
+        return self.load_delay
+
+    def release(self, model):
+        """Mark one request using a loaded model as finished"""
+        with self.changed:
+            self.running[model] -= 1
+            self.changed.notify_all()
+
+    def _make_room(self):
+        if len(self.loaded) + len(self.loading) < self.max_loaded:
+            return True
+        # Swapping: the least recently used idle model has to be loaded again next time
+        for loaded in self.loaded:
+            if not self.running[loaded]:
+                del self.loaded[loaded]
+                return True
+        return False
+
+    def should_fail(self):
+        if not self.failure_rate:
+            return False
+        with self.lock:
+            failed = self.random.random() < self.failure_rate
+            self.failures += failed
+        return failed
+
+    def reply_tokens_for(self, model, messages):
+        seed = sum(len(m.get("content", "")) for m in messages) + len(model)
+        return [WORDS[(seed + i * 7) % len(WORDS)] + " " for i in range(self.reply_tokens)]
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, payload, status=200):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _drop_if_down(self):
+            if state.down:
+                self.close_connection = True
+                self.connection.close()
+            return state.down
+
+        def do_GET(self):
+            if self._drop_if_down():
+                return
+            if self.path == "/api/tags":
+                now = datetime.now(timezone.utc).isoformat()
+                self._send_json({"models": [
+                    {"name": m, "model": m, "size": 1_000_000_000, "modified_at": now}
+                    for m in state.models]})
+            elif self.path == "/api/ps":
+                self._send_json({"models": [{"name": m, "model": m} for m in sorted(state.loaded)]})
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def do_POST(self):
+            if self._drop_if_down():
+                return
+            if self.path not in ("/api/chat", "/api/generate"):
+                self._send_json({"error": "not found"}, status=404)
+                return
+            request = self._read_json()
+            model = request.get("model", "")
+            if model not in state.models:
+                self._send_json({"error": f"model '{model}' not found"}, status=404)
+                return
+            if state.should_fail():
+                self._send_json({"error": "simulated failure"}, status=500)
+                return
+            state.begin()
+            started = time.perf_counter()
+            load_duration = state.load(model)
+            try:
+                self._generate(request, model, self.path == "/api/chat", started, load_duration)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client cancelled the generation
+                self.close_connection = True
+            finally:
+                state.release(model)
+                state.end()
+
+        def _generate(self, request, model, chat, started, load_duration):
+            messages = request.get("messages") or []
+            if not chat:
+                messages = [{"role": "user", "content": request.get("prompt") or ""}]
+            # An empty prompt only loads the model, as in real Ollama
+            tokens = state.reply_tokens_for(model, messages) if any(m.get("content") for m in messages) else []
+            delay = 1.0 / state.tokens_per_second if state.tokens_per_second else 0.0
+            prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+            prompt_delay = prompt_tokens / state.prompt_tokens_per_second if state.prompt_tokens_per_second else 0.0
+            time.sleep(prompt_delay)
+
+            def part(text, done):
+                payload = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+                if chat:
+                    payload["message"] = {"role": "assistant", "content": text}
+                else:
+                    payload["response"] = text
+                if done:
+                    total = time.perf_counter() - started
+                    payload.update({
+                        "done_reason": "stop",
+                        "total_duration": int(total * 1e9),
+                        "load_duration": int(load_duration * 1e9),
+                        "prompt_eval_count": prompt_tokens,
+                        "prompt_eval_duration": int(max(prompt_delay, 0.001) * 1e9),
+                        "eval_count": len(tokens),
+                        "eval_duration": int(max(total - load_duration - prompt_delay, 0) * 1e9),
+                    })
+                return payload
+
+            if request.get("stream", True):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for token in tokens:
+                    time.sleep(delay)
+                    self._write_chunk(part(token, False))
+                self._write_chunk(part("", True))
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                time.sleep(delay * len(tokens))
+                self._send_json(part("".join(tokens), True))
+
+        def _write_chunk(self, payload):
+            data = json.dumps(payload).encode() + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+    return Handler
+
+
+def start_server(port=0, models=("qwen2:1.5b", "llama3.2:1b"), **settings):
+    """Start the fake server in a background thread and return (server, state)"""
+    state = FakeOllamaState(models, **settings)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake Ollama server")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--models", default="qwen2:1.5b,llama3.2:1b")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=0.0)
+    parser.add_argument("--max-loaded", type=int, default=0, help="models kept in memory, 0 for all")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests failing with 500")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, _ = start_server(args.port, args.models.split(","),
+                             tokens_per_second=args.tokens_per_second,
+                             reply_tokens=args.reply_tokens,
+                             load_delay=args.load_delay,
+                             prompt_tokens_per_second=args.prompt_tokens_per_second,
+                             max_loaded=args.max_loaded,
+                             failure_rate=args.failure_rate,
+                             seed=args.seed)
+    print(f"Fake Ollama listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Per-turn latency of long dialogues with and without a history window
+Runs a 50-round Conversation against the fake Ollama server, whose prompt processing time grows
+with the prompt length like a real model's, and reports the latency of turn 5 and turn 50.
+
+    python benchmarks/history_bench.py --rounds 50 --max-tokens 1024
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_ollama import start_server  # noqa: E402
+from conversation import Conversation, Participant  # noqa: E402
+from history import ConversationHistory  # noqa: E402
+from inference import InferenceClient  # noqa: E402
+
+
+async def run_dialogue(host, rounds, max_tokens):
+    """Return per-turn latencies and final prompt sizes of one dialogue"""
+    client = InferenceClient(host=host)
+    first = Participant("Astronaut", 'qwen2:1.5b', 'You are an astronaut.')
+    second = Participant("Student", 'llama3.2:1b', 'You are a student.')
+    dialogue = Conversation.alternating(
+        client, first, second, rounds,
+        history=lambda participant, messages: ConversationHistory(messages, max_tokens=max_tokens))
+    latencies = []
+    dialogue.start()
+    previous = time.perf_counter()
+    async for turn in dialogue:
+        async for _ in turn.pieces():
+            pass
+        now = time.perf_counter()
+        latencies.append(now - previous)
+        previous = now
+    await client.aclose()
+    return latencies, first.history.token_count, second.history.token_count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-turn latency with and without a history window")
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--max-tokens", type=int, default=1024)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=2000.0)
+    parser.add_argument("--tokens-per-second", type=float, default=400.0)
+    args = parser.parse_args()
+
+    fake, _ = start_server(tokens_per_second=args.tokens_per_second, reply_tokens=40,
+                           prompt_tokens_per_second=args.prompt_tokens_per_second)
+    host = f"http://127.0.0.1:{fake.server_address[1]}"
+    try:
+        for label, max_tokens in (("full history", None), (f"window {args.max_tokens}", args.max_tokens)):
+            latencies, tokens1, tokens2 = asyncio.run(run_dialogue(host, args.rounds, max_tokens))
+            # Turn N of the dialogue is the Nth reply of the second speaker (index 2N - 1)
+            turn5 = latencies[min(9, len(latencies) - 1)]
+            turn_last = latencies[-1]
+            print(f"{label:>14}: turn 5 {turn5 * 1000:6.0f}ms, turn {args.rounds} {turn_last * 1000:6.0f}ms, "
+                  f"total {sum(latencies):6.1f}s, final prompt ~{max(tokens1, tokens2)} tokens")
+    finally:
+        fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
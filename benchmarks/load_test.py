@@ -0,0 +1,205 @@
+"""
+Concurrent conversation load test for web_app.py
+Starts a fake Ollama server and the web app, runs N conversations at once and checks that
+they progress in parallel and that /api/models stays responsive meanwhile. Reports p50/p95/p99
+time to first event and first token, end-to-end conversation time, the server's event loop lag
+and resident memory; --output saves them as JSON for benchmarks/compare.py.
+
+    python benchmarks/load_test.py --conversations 10
+    python benchmarks/load_test.py --conversations 50 --failure-rate 0.02 --output before.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_ollama import start_server  # noqa: E402
+from benchmarks.report import (format_stats, histogram_percentiles, percentiles, rss_bytes,  # noqa: E402
+                               save_results)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_web_app(ollama_port, env=None, workers=1):
+    """Run web_app.py under uvicorn in a subprocess and wait until it answers"""
+    port = free_port()
+    process_env = dict(os.environ, OLLAMA_HOST=f"http://127.0.0.1:{ollama_port}", **(env or {}))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "web_app:app", "--port", str(port), "--log-level", "warning",
+         "--workers", str(workers)],
+        cwd=ROOT, env=process_env)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"{base_url}/api/models", timeout=1.0)
+            return process, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("web app did not start")
+
+
+async def run_conversation(client, base_url, config):
+    """Start one conversation and consume its event stream
+
+    Returns a dict with the elapsed time, the number of events, the time until the first event
+    and until the first message chunk (the time-to-first-token a user sees), and whether the
+    conversation ended with an error.
+    """
+    started = time.perf_counter()
+    response = await client.post(f"{base_url}/api/conversation/start", json=config)
+    response.raise_for_status()
+    conversation_id = response.json()["conversation_id"]
+    events = 0
+    first_event = first_chunk = None
+    failed = False
+    stream_url = f"{base_url}/api/conversation/{conversation_id}/stream?format=ndjson"
+    async with client.stream("GET", stream_url) as stream:
+        async for line in stream.aiter_lines():
+            if not line:
+                continue
+            events += 1
+            if first_event is None:
+                first_event = time.perf_counter() - started
+            event = json.loads(line)
+            # Strings are chunks of the current message
+            event_type = "message_chunk" if isinstance(event, str) else event.get("type")
+            if event_type == "message_chunk" and first_chunk is None:
+                first_chunk = time.perf_counter() - started
+            if event_type in ("complete", "error", "cancelled"):
+                failed = event_type != "complete"
+                break
+    return {"elapsed": time.perf_counter() - started, "events": events, "first_event": first_event,
+            "first_chunk": first_chunk, "failed": failed}
+
+
+async def probe_models(client, base_url, stop):
+    """Measure /api/models latency while conversations are running"""
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        await client.get(f"{base_url}/api/models")
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.1)
+    return latencies
+
+
+async def sample_memory(pid, stop):
+    """Peak resident memory of the server while conversations are running"""
+    peak = rss_bytes(pid)
+    while not stop.is_set() and peak is not None:
+        await asyncio.sleep(0.2)
+        peak = max(peak, rss_bytes(pid) or 0)
+    return peak
+
+
+async def load_test(base_url, conversations, config, server_pid):
+    async with httpx.AsyncClient(timeout=None) as client:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_models(client, base_url, stop))
+        memory = asyncio.create_task(sample_memory(server_pid, stop))
+        started = time.perf_counter()
+        results = await asyncio.gather(*(run_conversation(client, base_url, config)
+                                         for _ in range(conversations)))
+        wall = time.perf_counter() - started
+        stop.set()
+        latencies = await probe
+        peak_rss = await memory
+        metrics_text = (await client.get(f"{base_url}/metrics")).text
+    return wall, results, latencies, peak_rss, metrics_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run N concurrent conversations against a fake Ollama")
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=2)
+    parser.add_argument("--tokens-per-second", type=float, default=40.0)
+    parser.add_argument("--reply-tokens", type=int, default=20)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of model calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the fake server's failures")
+    parser.add_argument("--typing-speed", type=float, default=10000.0,
+                        help="server-side typing speed in chars/s (only used with --no-stream)")
+    parser.add_argument("--no-stream", action="store_true", help="use server-side typewriter pacing")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--store", default="memory",
+                        help="conversation store, e.g. sqlite:///conversations.db (needed for --workers > 1)")
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args()
+
+    fake, state = start_server(tokens_per_second=args.tokens_per_second, reply_tokens=args.reply_tokens,
+                               load_delay=args.load_delay, models=("qwen2:1.5b", "llama3.2:1b"),
+                               failure_rate=args.failure_rate, seed=args.seed)
+    # Limits are raised so that every conversation runs at once
+    process, base_url = start_web_app(fake.server_address[1],
+                                      env={"AITALK_MODEL_CONCURRENCY": str(args.conversations),
+                                           "AITALK_MAX_ACTIVE_TURNS": str(2 * args.conversations),
+                                           "AITALK_MAX_CONVERSATIONS": str(args.conversations),
+                                           "AITALK_MAX_QUEUED_TURNS": str(4 * args.conversations),
+                                           "AITALK_STORE": args.store},
+                                      workers=args.workers)
+    config = {"turns": args.turns, "typing_speed": args.typing_speed, "stream_tokens": not args.no_stream}
+    try:
+        wall, results, latencies, peak_rss, metrics_text = asyncio.run(
+            load_test(base_url, args.conversations, config, process.pid))
+        final_rss = rss_bytes(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+        fake.shutdown()
+
+    completed = [result for result in results if not result["failed"]]
+    durations = [result["elapsed"] for result in completed]
+    serial = sum(result["elapsed"] for result in results)
+    summary = {
+        "conversations": len(results),
+        "failed": len(results) - len(completed),
+        "model_call_failures": state.failures,
+        "wall_s": round(wall, 3),
+        "parallelism": round(serial / wall, 2),
+        "peak_model_calls": state.max_active,
+        "time_to_first_event_s": percentiles(result["first_event"] for result in results
+                                             if result["first_event"] is not None),
+        "time_to_first_token_s": percentiles(result["first_chunk"] for result in results
+                                             if result["first_chunk"] is not None),
+        "conversation_s": percentiles(durations),
+        "models_latency_s": percentiles(latencies),
+        "event_loop_lag_s": histogram_percentiles(metrics_text, "aitalk_event_loop_lag_seconds"),
+        "server_rss_mb": {"peak": round(peak_rss / 2**20, 1), "final": round(final_rss / 2**20, 1)}
+        if peak_rss and final_rss else None,
+    }
+
+    print(f"conversations:        {summary['conversations']} ({summary['failed']} failed, "
+          f"{state.failures} model calls failed)")
+    print(f"wall clock:           {wall:.2f}s")
+    print(f"parallelism:          {summary['parallelism']:.1f}x")
+    print(f"peak model calls:     {state.max_active}")
+    print(f"first event:          {format_stats(summary['time_to_first_event_s'])}")
+    print(f"first token (TTFB):   {format_stats(summary['time_to_first_token_s'])}")
+    print(f"conversation:         {format_stats(summary['conversation_s'], 1, 's', 2)}")
+    print(f"/api/models latency:  {format_stats(summary['models_latency_s'])}")
+    print(f"event loop lag:       {format_stats(summary['event_loop_lag_s'], digits=1)}")
+    if summary["server_rss_mb"]:
+        print(f"server memory:        peak {summary['server_rss_mb']['peak']} MB, "
+              f"final {summary['server_rss_mb']['final']} MB")
+    if args.output:
+        save_results(args.output, "load_test", vars(args), summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Result helpers shared by the benchmarks
+Percentiles, server memory and event loop lag readings, and JSON result files that
+compare.py can diff across commits.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, Iterable, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentiles(values: Iterable[float], points=(50, 95, 99)) -> Optional[Dict[str, float]]:
+    """p50/p95/p99 (linear interpolation), mean and max of the values, or None if there are none"""
+    values = sorted(values)
+    if not values:
+        return None
+    result = {}
+    for point in points:
+        rank = (len(values) - 1) * point / 100
+        low = int(rank)
+        high = min(low + 1, len(values) - 1)
+        result[f"p{point}"] = round(values[low] + (values[high] - values[low]) * (rank - low), 4)
+    result["mean"] = round(sum(values) / len(values), 4)
+    result["max"] = round(values[-1], 4)
+    return result
+
+
+def histogram_percentiles(metrics_text: str, name: str, points=(50, 95, 99)) -> Optional[Dict[str, float]]:
+    """Estimate percentiles of a Prometheus histogram from its buckets, summed over all labels
+
+    Like histogram_quantile(), values are interpolated linearly within a bucket, so the result
+    is only as precise as the bucket bounds.
+    """
+    buckets: Dict[float, float] = {}
+    total = 0.0
+    for line in metrics_text.splitlines():
+        if line.startswith(f"{name}_bucket{{"):
+            labels, value = line.rsplit(" ", 1)
+            bound = labels.split('le="', 1)[1].split('"', 1)[0]
+            key = float("inf") if bound == "+Inf" else float(bound)
+            buckets[key] = buckets.get(key, 0.0) + float(value)
+        elif line.startswith(f"{name}_count"):
+            total += float(line.rsplit(" ", 1)[1])
+    if not total:
+        return None
+    bounds = sorted(buckets)
+    result = {}
+    for point in points:
+        target = total * point / 100
+        previous_bound, previous_count = 0.0, 0.0
+        for bound in bounds:
+            count = buckets[bound]
+            if count >= target:
+                if bound == float("inf"):
+                    result[f"p{point}"] = previous_bound
+                else:
+                    share = (target - previous_count) / (count - previous_count) if count > previous_count else 1.0
+                    result[f"p{point}"] = round(previous_bound + (bound - previous_bound) * share, 4)
+                break
+            previous_bound, previous_count = bound, count
+    result["samples"] = int(total)
+    return result
+
+
+def rss_bytes(pid: int) -> Optional[int]:
+    """Resident memory of a process and its children (e.g. uvicorn workers); None off Linux"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            rss = next(int(line.split()[1]) * 1024 for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        children = []
+    for child in children:
+        rss += rss_bytes(child) or 0
+    return rss
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path: str, benchmark: str, settings: dict, results: dict):
+    """Write a result file with enough context to compare runs across commits"""
+    record = {
+        "benchmark": benchmark,
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "settings": settings,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, indent=2)
+        f.write("\n")
+    print(f"results saved to {path}")
+
+
+def flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves of a nested result dict, keyed by dotted path"""
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def format_stats(stats: Optional[Dict[str, float]], scale: float = 1000.0, unit: str = "ms",
+                 digits: int = 0) -> str:
+    """One line of percentiles, in milliseconds by default"""
+    if not stats:
+        return "n/a"
+    parts: List[str] = [f"{key} {stats[key] * scale:.{digits}f}{unit}" for key in ("p50", "p95", "p99", "max")
+                        if key in stats]
+    return ", ".join(parts)
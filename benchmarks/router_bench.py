@@ -0,0 +1,105 @@
+"""
+Load balancing and failover across several Ollama hosts
+Starts a few fake Ollama servers with a model load delay, runs concurrent conversations through
+an InferenceClient routing between them and reports how calls and cold model loads were spread.
+With --kill-after, one server is shut down mid-run to exercise failover.
+
+    python benchmarks/router_bench.py --backends 3 --conversations 12 --load-delay 2 --kill-after 3
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_ollama import start_server  # noqa: E402
+from conversation import Conversation, Participant  # noqa: E402
+from inference import InferenceClient  # noqa: E402
+
+MODELS = ("qwen2:1.5b", "llama3.2:1b")
+
+
+async def run_conversation(client, rounds):
+    """Return (turns completed, error or None, load seconds, backend per turn)"""
+    dialogue = Conversation.alternating(
+        client,
+        Participant("Astronaut", MODELS[0], 'You are an astronaut.'),
+        Participant("Student", MODELS[1], 'You are a student.'),
+        rounds)
+    dialogue.start()
+    completed = 0
+    try:
+        async for turn in dialogue:
+            async for _ in turn.pieces():
+                pass
+            completed += 1
+    except Exception as e:
+        return completed, f"{type(e).__name__}: {e}", 0.0
+    finally:
+        dialogue.cancel()
+    return completed, None, sum(turn.timing.load_time for turn in dialogue.turns)
+
+
+async def run(backends, conversations, rounds, kill_after, servers, states):
+    client = InferenceClient(backends=backends)
+    client.start()
+    # Let the first health check see the (empty) loaded model lists
+    await asyncio.sleep(0.2)
+
+    async def kill():
+        await asyncio.sleep(kill_after)
+        print(f"shutting down {backends[0]['host']}")
+        servers[0].shutdown()
+        servers[0].server_close()
+        # Open keep-alive connections are dropped as well
+        states[0].down = True
+
+    killer = asyncio.create_task(kill()) if kill_after else None
+    started = time.perf_counter()
+    results = await asyncio.gather(*(run_conversation(client, rounds) for _ in range(conversations)))
+    elapsed = time.perf_counter() - started
+    if killer is not None:
+        await killer
+    await client.aclose()
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread conversations over several fake Ollama hosts")
+    parser.add_argument("--backends", type=int, default=3)
+    parser.add_argument("--conversations", type=int, default=12)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--max", type=int, default=4, help="max concurrency per backend")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--load-delay", type=float, default=2.0)
+    parser.add_argument("--kill-after", type=float, default=0.0, help="seconds before the first server is stopped")
+    args = parser.parse_args()
+
+    servers, states = zip(*(start_server(tokens_per_second=args.tokens_per_second, reply_tokens=30,
+                                         load_delay=args.load_delay) for _ in range(args.backends)))
+    backends = [{"host": f"http://127.0.0.1:{server.server_address[1]}", "max_concurrency": args.max}
+                for server in servers]
+    try:
+        elapsed, results = asyncio.run(run(backends, args.conversations, args.rounds, args.kill_after,
+                                           servers, states))
+    finally:
+        for server in servers[1 if args.kill_after else 0:]:
+            server.shutdown()
+
+    failed = [error for _, error, _ in results if error]
+    print(f"conversations:  {len(results)} in {elapsed:.1f}s, {len(failed)} failed")
+    for error in sorted(set(failed)):
+        print(f"  {error}")
+    print(f"turns:          {sum(completed for completed, _, _ in results)}")
+    print(f"load time:      {sum(load for _, _, load in results):.1f}s spent waiting for cold models")
+    for backend, state in zip(backends, states):
+        print(f"{backend['host']}: {state.requests:3d} calls, peak {state.max_active} concurrent, "
+              f"models loaded: {', '.join(sorted(state.loaded)) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Fair scheduling and model batching of conversation turns
+Runs a mix of long and short conversations against one fake Ollama host that keeps a single
+model in memory, so every model switch pays the load delay. Compares a single first-come queue
+with the TurnScheduler in strict round-robin and batched mode, all under the same
+concurrency cap, reporting wall time, model loads and how long the short conversations took.
+
+    python benchmarks/scheduler_bench.py --long 8 --short 8 --max-active 4 --batch 4
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_ollama import start_server  # noqa: E402
+from conversation import Conversation, Participant  # noqa: E402
+from inference import InferenceClient  # noqa: E402
+from scheduler import ScheduledClient, TurnScheduler  # noqa: E402
+
+MODELS = ("qwen2:1.5b", "llama3.2:1b")
+
+
+async def run_conversation(client, rounds):
+    """Return the seconds until the conversation's last turn was generated"""
+    started = time.perf_counter()
+    dialogue = Conversation.alternating(
+        client,
+        Participant("Astronaut", MODELS[0], 'You are an astronaut.'),
+        Participant("Student", MODELS[1], 'You are a student.'),
+        rounds)
+    dialogue.start()
+    try:
+        async for turn in dialogue:
+            async for _ in turn.pieces():
+                pass
+    finally:
+        dialogue.cancel()
+    return time.perf_counter() - started
+
+
+async def run(host, args, batch, fair=True):
+    """Run every conversation; without fair, all calls share one first-come queue"""
+    client = InferenceClient(host)
+    scheduler = TurnScheduler(max_active=args.max_active, model_limits={}, batch=batch)
+    rounds = [args.long_rounds] * args.long + [args.short_rounds] * args.short
+
+    def client_for(index):
+        return ScheduledClient(client, scheduler, f"conversation-{index}" if fair else "all")
+
+    started = time.perf_counter()
+    # Long conversations start first, as if they had been running when the short ones arrived
+    results = await asyncio.gather(*(run_conversation(client_for(i), r) for i, r in enumerate(rounds)))
+    elapsed = time.perf_counter() - started
+    await client.aclose()
+    return elapsed, results[:args.long], results[args.long:]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare turn scheduling policies on a host that swaps models")
+    parser.add_argument("--long", type=int, default=4, help="conversations with --long-rounds rounds")
+    parser.add_argument("--short", type=int, default=4, help="conversations with --short-rounds rounds")
+    parser.add_argument("--long-rounds", type=int, default=4)
+    parser.add_argument("--short-rounds", type=int, default=1)
+    parser.add_argument("--max-active", type=int, default=2, help="model calls running at once")
+    parser.add_argument("--batch", type=int, default=4, help="consecutive slots for the same model")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--load-delay", type=float, default=0.5)
+    args = parser.parse_args()
+
+    for label, batch, fair in (("first-come", 0, False), ("round-robin", 0, True),
+                               (f"batch {args.batch}", args.batch, True)):
+        server, state = start_server(tokens_per_second=args.tokens_per_second, reply_tokens=30,
+                                     load_delay=args.load_delay, max_loaded=1)
+        try:
+            elapsed, long, short = asyncio.run(run(f"http://127.0.0.1:{server.server_address[1]}", args,
+                                                   batch, fair))
+        finally:
+            server.shutdown()
+        print(f"{label:12s} {elapsed:5.1f}s total, {state.loads:3d} model loads, "
+              f"short conversations {statistics.mean(short):.1f}s mean / {max(short):.1f}s max, "
+              f"long {statistics.mean(long):.1f}s mean")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Micro-benchmark of conversation stream encoding
+Encodes a synthetic conversation the way web_app.py used to (an f-string around json.dumps for
+every token) and with sse.EventEncoder, per token and with chunks coalesced into flush intervals.
+Reports encoding throughput in events/s and the bytes and frames sent per conversation.
+
+    python benchmarks/sse_bench.py --turns 8 --tokens 150 --tokens-per-second 60 --flush-ms 50
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sse import EventEncoder  # noqa: E402
+
+MODELS = ("qwen2:1.5b", "llama3.2:1b")
+
+
+def synthetic_turns(turns, tokens, seed=0):
+    """Per turn, a list of 1-5 character tokens"""
+    rng = random.Random(seed)
+    alphabet = "abcdefghijklmnopqrstuvwxyz     ,."
+    return [["".join(rng.choice(alphabet) for _ in range(rng.randint(1, 5))) for _ in range(tokens)]
+            for _ in range(turns)]
+
+
+def coalesce(tokens, tokens_per_second, flush_ms):
+    """Group tokens arriving at a steady rate into one chunk per flush interval"""
+    if not flush_ms:
+        return list(tokens)
+    per_frame = max(1, int(tokens_per_second * flush_ms / 1000))
+    return ["".join(tokens[i:i + per_frame]) for i in range(0, len(tokens), per_frame)]
+
+
+def legacy_events(turns):
+    for index, tokens in enumerate(turns):
+        model = MODELS[index % 2]
+        yield f"data: {json.dumps({'type': 'thinking', 'model': model, 'turn': index + 1})}\n\n"
+        yield f"data: {json.dumps({'type': 'message_start', 'model': model, 'turn': index + 1})}\n\n"
+        for content in tokens:
+            yield f"data: {json.dumps({'type': 'message_chunk', 'content': content, 'model': model})}\n\n"
+        yield f"data: {json.dumps({'type': 'message_end', 'model': model})}\n\n"
+
+
+def encoder_events(turns, encoder):
+    for index, chunks in enumerate(turns):
+        model = MODELS[index % 2]
+        yield encoder.event('thinking', model=model, turn=index + 1)
+        yield encoder.event('message_start', model=model, turn=index + 1, cached=False)
+        for content in chunks:
+            yield encoder.chunk(content)
+        yield encoder.event('message_end', model=model)
+
+
+def measure(label, make_events, repeat):
+    frames = list(make_events())
+    size = sum(len(frame.encode()) for frame in frames)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for _ in make_events():
+            pass
+    elapsed = time.perf_counter() - started
+    print(f"{label:>24}: {len(frames) * repeat / elapsed:10.0f} events/s, "
+          f"{len(frames):5d} frames, {size:7d} bytes per conversation")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare stream encodings of a synthetic conversation")
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=150, help="tokens per turn")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--flush-ms", type=float, default=50.0)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    turns = synthetic_turns(args.turns, args.tokens)
+    coalesced = [coalesce(tokens, args.tokens_per_second, args.flush_ms) for tokens in turns]
+    sse, ndjson = EventEncoder("sse"), EventEncoder("ndjson")
+    measure("json.dumps per token", lambda: legacy_events(turns), args.repeat)
+    measure("encoder per token", lambda: encoder_events(turns, sse), args.repeat)
+    measure(f"encoder {args.flush_ms:g}ms frames", lambda: encoder_events(coalesced, sse), args.repeat)
+    measure(f"ndjson {args.flush_ms:g}ms frames", lambda: encoder_events(coalesced, ndjson), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Headless runs of the terminal version (chatbots.py)
+Runs chatbots.main() several times against the fake Ollama server with the typewriter effect and
+pauses turned off, and reports p50/p95/p99 time to first token per turn and end-to-end
+conversation time. --output saves the results as JSON for benchmarks/compare.py.
+
+    python benchmarks/terminal_bench.py --runs 5 --output terminal.json
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import resource
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fake_ollama import start_server  # noqa: E402
+from benchmarks.report import format_stats, percentiles, save_results  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the terminal conversation headlessly")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=4, help="replies per participant")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--reply-tokens", type=int, default=30)
+    parser.add_argument("--load-delay", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of model calls that fail")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the fake server's failures")
+    parser.add_argument("--output", help="save the results as JSON")
+    args = parser.parse_args()
+
+    fake, state = start_server(tokens_per_second=args.tokens_per_second, reply_tokens=args.reply_tokens,
+                               load_delay=args.load_delay, failure_rate=args.failure_rate, seed=args.seed)
+    # chatbots.py creates its Ollama clients on import
+    os.environ["OLLAMA_HOST"] = f"http://127.0.0.1:{fake.server_address[1]}"
+    os.environ.pop("AITALK_BACKENDS", None)
+    import chatbots
+    chatbots.TYPEWRITER_SPEED = 0
+    chatbots.TURN_PAUSE = 0
+    chatbots.CONVERSATION_TURNS = args.turns
+
+    durations, first_tokens, failed = [], [], 0
+    try:
+        for _ in range(args.runs):
+            chatbots.turn_timings.clear()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                chatbots.main()
+            elapsed = time.perf_counter() - started
+            timings = [timing for _, timing in chatbots.turn_timings]
+            if len(timings) < args.turns * len(chatbots.PARTICIPANTS) or any(t.status != "ok" for t in timings):
+                failed += 1
+                continue
+            durations.append(elapsed)
+            first_tokens.extend(t.time_to_first_token for t in timings if t.time_to_first_token is not None)
+    finally:
+        fake.shutdown()
+
+    # ru_maxrss is in kilobytes on Linux; this process also hosts the fake server
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    summary = {
+        "runs": args.runs,
+        "failed": failed,
+        "model_call_failures": state.failures,
+        "time_to_first_token_s": percentiles(first_tokens),
+        "conversation_s": percentiles(durations),
+        "peak_rss_mb": round(peak_rss, 1),
+    }
+    print(f"runs:                 {args.runs} ({failed} failed, {state.failures} model calls failed)")
+    print(f"first token per turn: {format_stats(summary['time_to_first_token_s'])}")
+    print(f"conversation:         {format_stats(summary['conversation_s'], 1, 's', 2)}")
+    print(f"peak memory:          {summary['peak_rss_mb']} MB (including the fake server)")
+    if args.output:
+        save_results(args.output, "terminal_bench", vars(args), summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,16 @@
 import ollama
+import itertools
+import os
 import time
 import sys
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from history import Transcript, TranscriptView
+from inference import CONNECTION_ERRORS, parse_backends
+from response_cache import cache_key, cacheable_response, create_response_cache
+from transcript_archive import create_archive
 
 # --- Improved Configuration ---
 # Separate context prompts for each model - they don't know about each other!
@@ -13,97 +23,193 @@ MODEL_1_CONTEXT = """You are an experienced astronaut who has just returned from
 MODEL_2_NAME = 'llama3.2:1b'
 MODEL_2_CONTEXT = """You are a curious high school student who is fascinated by space and science. You just met someone who seems to have interesting stories about space. You're eager to learn and ask thoughtful questions about their experiences."""
 
+# Everyone in the conversation, in speaking order; add entries for a group conversation.
+# With more than two participants, each one sees the others' replies prefixed with their name.
+PARTICIPANTS = [
+    {'name': 'Astronaut', 'model': MODEL_1_NAME, 'context': MODEL_1_CONTEXT, 'icon': '👨‍🚀'},
+    {'name': 'Student', 'model': MODEL_2_NAME, 'context': MODEL_2_CONTEXT, 'icon': '🧑‍🎓'},
+]
+
 # Conversation settings
-CONVERSATION_TURNS = 4
-TYPEWRITER_SPEED = 0.05
+CONVERSATION_TURNS = 4  # replies per participant
+TYPEWRITER_SPEED = 0.05  # 打字机效果（秒/字符），0 表示收到即输出
+TURN_PAUSE = 1.0  # 两轮之间的停顿（秒），0 表示不停顿
+SAMPLING_OPTIONS = None  # e.g. {'temperature': 0, 'seed': 42} for repeatable replies
+# Replies to identical prompts are reused when AITALK_RESPONSE_CACHE is set (memory or sqlite:///path)
+RESPONSE_CACHE = create_response_cache()
+# Every reply is appended to a searchable archive when AITALK_ARCHIVE names a directory
+ARCHIVE = create_archive()
+# Ollama hosts; AITALK_BACKENDS lists several, e.g. "http://gpu1:11434; http://gpu2:11434 models=llama3.2:1b"
+BACKENDS = parse_backends(os.getenv("AITALK_BACKENDS")) or [{"host": None}]
 # --- Configuration End ---
 
+CLIENTS = [ollama.Client(host=backend["host"]) for backend in BACKENDS]
+# model -> index of the backend that last served it, so the model stays loaded there
+model_backends = {}
+
+
+def call_with_failover(model_name, request):
+    """Run request(client) on the model's backend, moving on to the next one if it is unreachable"""
+    preferred = model_backends.get(model_name, 0)
+    order = sorted(range(len(BACKENDS)), key=lambda i: i != preferred)
+    order = [i for i in order if model_name in BACKENDS[i].get("models", {model_name})] or order
+    for n, i in enumerate(order):
+        try:
+            result = request(CLIENTS[i])
+        except CONNECTION_ERRORS:
+            if n == len(order) - 1:
+                raise
+            print(f"\n⚠️  无法连接 {BACKENDS[i]['host']}，切换到下一个Ollama后端...")
+            continue
+        model_backends[model_name] = i
+        return result
+
+
+def open_stream(client, model_name, messages):
+    """Start a streamed chat; the connection is made when the first part is read"""
+    stream = client.chat(model=model_name, messages=messages, stream=True, options=SAMPLING_OPTIONS)
+    first = next(stream, None)
+    return itertools.chain([first] if first is not None else [], stream)
+
 
-def stream_to_terminal(text, speed):
-    """以打字机效果将文本逐字输出到终端"""
-    for char in text:
-        sys.stdout.write(char)
-        sys.stdout.flush()
-        time.sleep(speed)
+def stream_to_terminal(chunks, speed):
+    """以打字机效果将文本逐字输出到终端
+
+    chunks 可以是完整字符串，也可以是模型实时生成的文本片段
+    """
+    if isinstance(chunks, str):
+        chunks = [chunks]
+    for chunk in chunks:
+        for char in chunk:
+            sys.stdout.write(char)
+            sys.stdout.flush()
+            if speed:
+                time.sleep(speed)
     print()
 
 
-def initialize_model_context(model_name, context_prompt):
-    """Initialize a model with its own private context without revealing the conversation structure"""
-    messages = [{'role': 'system', 'content': context_prompt}]
-    
-    # Get the model's natural opening based on their context
-    response = ollama.chat(model=model_name, messages=messages)
-    opening_message = response['message']['content']
-    
-    # Update history to include the opening
-    messages.append({'role': 'assistant', 'content': opening_message})
-    
-    return messages, opening_message
+# (turn number, CallTiming) of every reply, summarized when the conversation ends
+turn_timings = []
+
+
+def stream_reply(model_name, messages, turn=None):
+    """Stream the model's reply as it is generated and add it to the shared transcript
+
+    `messages` is the speaker's TranscriptView; Ollama and the cache key read it like a list.
+    """
+    reply = []
+    timing = metrics.CallTiming(model_name)
+    started = time.perf_counter()
+    final = None
+    key = cache_key(model_name, messages, options=SAMPLING_OPTIONS) if RESPONSE_CACHE is not None else None
+    cached = RESPONSE_CACHE.get(key) if key else None
+    try:
+        if cached is not None:
+            timing.status = "cached"
+            timing.update_from_response(cached)
+            parts = [cached]
+        else:
+            parts = call_with_failover(model_name, lambda client: open_stream(client, model_name, messages))
+            timing.backend = BACKENDS[model_backends[model_name]]["host"] or "default"
+        for part in parts:
+            content = part['message']['content']
+            if timing.time_to_first_token is None and content:
+                timing.time_to_first_token = time.perf_counter() - started
+            if part.get('done') and cached is None:
+                timing.update_from_response(part)
+                final = part
+            reply.append(content)
+            yield content
+    except Exception:
+        timing.status = "error"
+        raise
+    finally:
+        # Includes the time spent printing, since the terminal reads the stream as it arrives
+        timing.generation_time = time.perf_counter() - started
+        metrics.observe(timing)
+    turn_timings.append((turn, timing))
+    if key and final is not None:
+        RESPONSE_CACHE.put(key, cacheable_response(final, ''.join(reply)))
+    messages.transcript.add(messages.participant, ''.join(reply))
+
+
+def print_timing_summary(wall_time):
+    """Print per-model latency and token throughput of the conversation"""
+    summary = metrics.summarize_timings(turn_timings, wall_time)
+    print(f"⏱  总耗时 {summary['wall_s']:.1f}s")
+    for model, stats in summary['models'].items():
+        rate = f"{stats['eval_tokens_per_s']:.1f} tokens/s" if stats['eval_tokens_per_s'] else "n/a"
+        print(f"   {model}: {stats['turns']} 轮, 首字 {stats['avg_time_to_first_token_s']:.2f}s, "
+              f"{stats['completion_tokens']} tokens, {rate}, 加载 {stats['load_s']:.2f}s")
+
+
+def load_model(model_name):
+    """Load a model into memory ahead of its first turn"""
+    # An empty prompt only loads the model into memory, nothing is generated
+    call_with_failover(model_name, lambda client: client.generate(model=model_name, prompt=''))
 
 
 def main():
-    """运行改进的双AI对话，不让模型知道对方是AI"""
+    """运行改进的多AI对话，不让模型知道对方是AI"""
     print("="*50)
-    print(f"🤖 模型1: {MODEL_1_NAME} (Astronaut)")
-    print(f"🤖 模型2: {MODEL_2_NAME} (Student)")
+    for number, participant in enumerate(PARTICIPANTS, 1):
+        print(f"🤖 模型{number}: {participant['model']} ({participant['name']})")
     print("💬 Independent contexts - models don't know they're talking to AI!")
     print("="*50)
     print("\n初始化模型上下文...\n")
+    started = time.perf_counter()
+    conversation_id = str(uuid.uuid4())
+    status = "error"
+    if ARCHIVE is not None:
+        ARCHIVE.start()
+        ARCHIVE.start_conversation(conversation_id, {'turns': CONVERSATION_TURNS, 'source': 'terminal'},
+                                   [{'name': p['name'], 'model': p['model']} for p in PARTICIPANTS])
     
     try:
-        # Initialize each model with their own private context
-        print("Setting up Model 1 context...")
-        model_1_messages, model_1_opening = initialize_model_context(MODEL_1_NAME, MODEL_1_CONTEXT)
+        # Each participant keeps only its private context; the first one's opening is streamed below
+        for number, participant in enumerate(PARTICIPANTS, 1):
+            print(f"Setting up Model {number} context...")
         
-        print("Setting up Model 2 context...")
-        model_2_messages, _ = initialize_model_context(MODEL_2_NAME, MODEL_2_CONTEXT)
+        # The other models are loaded in the background while the first one generates its opening
+        executor = ThreadPoolExecutor(max_workers=1)
+        first_model = PARTICIPANTS[0]['model']
+        models_ready = {model: executor.submit(load_model, model)
+                        for model in dict.fromkeys(p['model'] for p in PARTICIPANTS) if model != first_model}
+        executor.shutdown(wait=False)
         
         print("\n对话开始...\n")
-        time.sleep(2)
-        
-        # Start conversation with Model 1's natural opening
-        print(f"--- 第 1 轮 | {MODEL_1_NAME} 开始对话 ---\n")
-        stream_to_terminal(f"👨‍🚀 {MODEL_1_NAME}: {model_1_opening}", TYPEWRITER_SPEED)
-        
-        # This becomes the first message for Model 2 (without revealing it came from AI)
-        current_prompt = model_1_opening
+        time.sleep(2 * TURN_PAUSE)
         
-        # Continue conversation
-        for i in range(CONVERSATION_TURNS):
-            time.sleep(1)
+        # Replies are kept once in the shared transcript; each participant reads it through its own
+        # view, in which the others' replies arrive as if from human conversation partners
+        transcript = Transcript([p['name'] for p in PARTICIPANTS])
+        views = [TranscriptView(transcript, index, p['context'], named=len(PARTICIPANTS) > 2)
+                 for index, p in enumerate(PARTICIPANTS)]
+        replies = [0] * len(PARTICIPANTS)
+        # Participants always speak in order here; the web app offers the other turn policies
+        for step in range(CONVERSATION_TURNS * len(PARTICIPANTS)):
+            index = step % len(PARTICIPANTS)
+            participant = PARTICIPANTS[index]
+            replies[index] += 1
+            if step == 0:
+                print(f"--- 第 1 轮 | {participant['model']} 开始对话 ---\n")
+            else:
+                time.sleep(TURN_PAUSE)
+                print(f"\n--- 第 {replies[index]} 轮 | {participant['model']} 正在思考... ---\n")
+            stream_to_terminal(f"{participant['icon']} {participant['model']}:", TYPEWRITER_SPEED)
             
-            # --- Model 2's turn ---
-            print(f"\n--- 第 {i+1} 轮 | {MODEL_2_NAME} 正在思考... ---\n")
-            stream_to_terminal(f"🧑‍🎓 {MODEL_2_NAME}:", TYPEWRITER_SPEED)
-            
-            # Model 2 receives the message as if from a human conversation partner
-            model_2_messages.append({'role': 'user', 'content': current_prompt})
-            
-            response_2 = ollama.chat(model=MODEL_2_NAME, messages=model_2_messages)
-            response_2_content = response_2['message']['content']
-            
-            stream_to_terminal(response_2_content, TYPEWRITER_SPEED)
-            model_2_messages.append({'role': 'assistant', 'content': response_2_content})
-            
-            current_prompt = response_2_content
-            time.sleep(1)
-            
-            if i < CONVERSATION_TURNS - 1:  # Don't do Model 1's turn on the last iteration
-                # --- Model 1's turn ---
-                print(f"\n--- 第 {i+2} 轮 | {MODEL_1_NAME} 正在思考... ---\n")
-                stream_to_terminal(f"👨‍🚀 {MODEL_1_NAME}:", TYPEWRITER_SPEED)
-                
-                # Model 1 receives the message as if from a human conversation partner
-                model_1_messages.append({'role': 'user', 'content': current_prompt})
-                
-                response_1 = ollama.chat(model=MODEL_1_NAME, messages=model_1_messages)
-                response_1_content = response_1['message']['content']
-                
-                stream_to_terminal(response_1_content, TYPEWRITER_SPEED)
-                model_1_messages.append({'role': 'assistant', 'content': response_1_content})
-                
-                current_prompt = response_1_content
+            if participant['model'] in models_ready:
+                models_ready.pop(participant['model']).result()
+            stream_to_terminal(stream_reply(participant['model'], views[index], replies[index]), TYPEWRITER_SPEED)
+            if ARCHIVE is not None:
+                ARCHIVE.add_turn(conversation_id, step, replies[index], index, participant['name'],
+                                 participant['model'], transcript.entries[-1]['content'],
+                                 turn_timings[-1][1].as_dict())
+        status = "completed"
+    
+    except KeyboardInterrupt:
+        status = "cancelled"
+        print("\n\n对话已中断。")
 
     except Exception as e:
         print(f"\n\n程序出错: {e}")
@@ -111,6 +217,17 @@ def main():
 
     print("\n\n" + "="*50)
     print("对话结束。")
+    if turn_timings:
+        print_timing_summary(time.perf_counter() - started)
+    if ARCHIVE is not None:
+        ARCHIVE.end_conversation(conversation_id, status,
+                                 metrics.summarize_timings(turn_timings, time.perf_counter() - started))
+        ARCHIVE.close()
+        print(f"   对话已存档: {conversation_id}")
+    if RESPONSE_CACHE is not None:
+        stats = RESPONSE_CACHE.stats()
+        print(f"   缓存命中 {stats['hits']}/{stats['hits'] + stats['misses']} ({stats['hit_rate']:.0%})")
+        RESPONSE_CACHE.close()
     print("="*50)
 
 
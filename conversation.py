@@ -0,0 +1,453 @@
+"""
+Conversation engine for AiTalkDual
+Any number of participants, each a model with a private context, take turns as decided by a
+turn policy. The next speaker starts generating as soon as the replies it depends on are
+complete, while they are still being rendered to the client; speakers chosen together answer the
+same transcript and generate concurrently. Replies are stored once in a shared transcript.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from typing import Awaitable, Callable, List, Literal, Optional
+
+from pydantic import BaseModel
+
+from history import ConversationHistory, Transcript, TranscriptView, model_summarizer
+from metrics import CallTiming, summarize_timings
+
+logger = logging.getLogger(__name__)
+
+
+class ParticipantConfig(BaseModel):
+    model: str
+    context: str
+    name: Optional[str] = None  # how the others address this participant, defaults to the model
+
+
+class ImprovedConversationConfig(BaseModel):
+    model1: str = "qwen2:1.5b"
+    model2: str = "llama3.2:1b"
+    model1_context: str = """You are an experienced astronaut who has just returned from a mission to the International Space Station. You're feeling excited and want to share your experiences with someone. Start by telling them about the most amazing moment during your recent space mission."""
+    model2_context: str = """You are a curious high school student who is fascinated by space and science. You just met someone who seems to have interesting stories about space. You're eager to learn and ask thoughtful questions about their experiences."""
+    turns: int = 4
+    typing_speed: float = 50.0  # chars per second
+    stream_tokens: bool = True  # forward tokens as generated; typing pacing is done by the client
+    history_max_tokens: Optional[int] = None  # sliding window budget per model, None sends the full history
+    history_summarize: bool = False  # fold messages that leave the window into a rolling summary
+    temperature: Optional[float] = None  # sampling overrides; 0 or a fixed seed make replies repeatable
+    seed: Optional[int] = None
+    participants: Optional[List[ParticipantConfig]] = None  # two or more speakers, replacing model1/model2
+    turn_policy: Literal["round_robin", "addressed", "moderator"] = "round_robin"
+    moderator_model: Optional[str] = None  # picks the next speaker for the moderator policy
+
+    def participant_configs(self) -> List[ParticipantConfig]:
+        """The participants in speaking order, each with a distinct name"""
+        participants = self.participants or [
+            ParticipantConfig(model=self.model1, context=self.model1_context),
+            ParticipantConfig(model=self.model2, context=self.model2_context),
+        ]
+        named, seen = [], set()
+        for participant in participants:
+            name = base = participant.name or participant.model
+            count = 1
+            while name in seen:
+                count += 1
+                name = f"{base} ({count})"
+            seen.add(name)
+            named.append(ParticipantConfig(model=participant.model, context=participant.context, name=name))
+        return named
+
+    def models(self) -> List[str]:
+        """Every model the conversation calls"""
+        models = [participant.model for participant in self.participant_configs()]
+        if self.turn_policy == "moderator" and self.moderator_model:
+            models.append(self.moderator_model)
+        return list(dict.fromkeys(models))
+
+    def max_parallel_calls(self) -> int:
+        """Most model calls the conversation can have in flight at once: a reply from every
+        participant, plus a background summary each when summarizing"""
+        participants = len(self.participant_configs())
+        return participants * 2 if self.history_summarize else participants
+
+    def model_options(self) -> Optional[dict]:
+        """Ollama options for the sampling overrides that are set"""
+        options = {key: value for key, value in (("temperature", self.temperature), ("seed", self.seed))
+                   if value is not None}
+        return options or None
+
+
+def make_history(client, config: ImprovedConversationConfig, model: str, messages: List[dict]) -> ConversationHistory:
+    """Wrap a model's message list in the history policy chosen for the conversation"""
+    summarizer = model_summarizer(client, model) if config.history_summarize else None
+    return ConversationHistory(messages, max_tokens=config.history_max_tokens, summarizer=summarizer)
+
+
+class Participant:
+    """A model with its private context; its history is a view of the shared transcript"""
+
+    def __init__(self, name: str, model: str, context: str, ready: Optional[Awaitable] = None,
+                 options: Optional[dict] = None):
+        self.name = name
+        self.model = model
+        self.context = context
+        # Optional awaitable (e.g. a preload task) that must finish before the first reply
+        self.ready = ready
+        self.options = options
+        # Set when the participant joins a Conversation
+        self.index = 0
+        self.history: Optional[ConversationHistory] = None
+        self.replies = 0
+
+
+class Turn:
+    """One reply in the conversation; generated text is buffered until it is rendered"""
+
+    def __init__(self, index: int, speaker: Participant, number: int):
+        self.index = index
+        self.speaker = speaker
+        # The speaker's own reply count, starting at 1
+        self.number = number
+        self.content: Optional[str] = None
+        # Final response from Ollama, carrying token counts and durations
+        self.response = None
+        self.timing = CallTiming(speaker.model)
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    @property
+    def model(self) -> str:
+        return self.speaker.model
+
+    @property
+    def cached(self) -> bool:
+        """Whether the reply was served from the response cache"""
+        return self.timing.status == "cached"
+
+    async def pieces(self, interval: float = 0.0):
+        """Yield the reply's text as it becomes available, raising if generation failed
+
+        Text that is already queued is joined into one piece. With an interval, a piece is held
+        until `interval` seconds after the previous one, so fast generation yields fewer pieces.
+        """
+        loop = asyncio.get_running_loop()
+        last = 0.0
+        while True:
+            item = await self._queue.get()
+            if interval:
+                wait = last + interval - loop.time()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            text = []
+            while isinstance(item, str):
+                text.append(item)
+                # False: nothing more queued for now
+                item = self._queue.get_nowait() if not self._queue.empty() else False
+            if text:
+                last = loop.time()
+                yield ''.join(text)
+            if item is None:
+                return
+            if isinstance(item, BaseException):
+                raise item
+
+
+class TurnPolicy:
+    """Decides who speaks next
+
+    next_speakers() returns the indexes of the participants that reply to the transcript as it
+    stands; several speakers answer concurrently. An empty list ends the conversation.
+    `max_replies` bounds the total number of replies.
+    """
+
+    def __init__(self, max_replies: int):
+        self.max_replies = max_replies
+        # Model calls the policy makes itself, reported by Conversation.timing_summary()
+        self.timings: List[CallTiming] = []
+
+    async def next_speakers(self, conversation: "Conversation") -> List[int]:
+        raise NotImplementedError
+
+    def remaining(self, conversation: "Conversation") -> int:
+        return self.max_replies - len(conversation.transcript)
+
+    @staticmethod
+    def after_last(conversation: "Conversation") -> int:
+        """The participant following the last speaker in speaking order"""
+        entries = conversation.transcript.entries
+        if not entries:
+            return 0
+        return (entries[-1]['speaker'] + 1) % len(conversation.participants)
+
+
+class NameMatcher:
+    """Finds participants' names in text, whole words only and ignoring case
+
+    Longer names claim their text first, so a mention of "qwen2:1.5b (2)" is not also read as
+    a mention of "qwen2:1.5b".
+    """
+
+    def __init__(self, names: List[str]):
+        self._patterns = sorted(
+            ((re.compile(r"(?<!\w)@?" + re.escape(name) + r"(?!\w)", re.IGNORECASE), index)
+             for index, name in enumerate(names)),
+            key=lambda item: -len(names[item[1]]))
+
+    def mentions(self, text: str) -> List[int]:
+        """Indexes of the names in the text, in order of first mention"""
+        taken = []
+        first = {}
+        for pattern, index in self._patterns:
+            for match in pattern.finditer(text):
+                if any(match.start() < end and start < match.end() for start, end in taken):
+                    continue
+                taken.append(match.span())
+                first.setdefault(index, match.start())
+        return sorted(first, key=first.get)
+
+
+class RoundRobin(TurnPolicy):
+    """Participants speak in a fixed order"""
+
+    async def next_speakers(self, conversation: "Conversation") -> List[int]:
+        if self.remaining(conversation) <= 0:
+            return []
+        return [self.after_last(conversation)]
+
+
+class AddressedReply(TurnPolicy):
+    """Whoever the last reply addresses by name answers next, all of them at once if several
+    are named; otherwise the next participant in order speaks"""
+
+    def __init__(self, max_replies: int, names: List[str]):
+        super().__init__(max_replies)
+        self._names = NameMatcher(names)
+
+    def addressed(self, content: str, speaker: int) -> List[int]:
+        """Participants named in a reply, in order of first mention"""
+        return [index for index in self._names.mentions(content) if index != speaker]
+
+    async def next_speakers(self, conversation: "Conversation") -> List[int]:
+        remaining = self.remaining(conversation)
+        if remaining <= 0:
+            return []
+        entries = conversation.transcript.entries
+        if entries:
+            speakers = self.addressed(entries[-1]['content'], entries[-1]['speaker'])[:remaining]
+            if speakers:
+                return speakers
+        return [self.after_last(conversation)]
+
+
+MODERATOR_INSTRUCTIONS = ("You moderate a conversation between {names}. Read the latest messages and decide who "
+                          "should speak next. Reply with exactly one name from that list and nothing else.")
+# Messages shown to the moderator when it picks the next speaker
+MODERATOR_WINDOW = 6
+
+
+class ModeratorPicks(TurnPolicy):
+    """A moderator model reads the latest replies and names the next speaker"""
+
+    def __init__(self, max_replies: int, client, model: str, names: List[str]):
+        super().__init__(max_replies)
+        self.client = client
+        self.model = model
+        self.names = names
+        self._matcher = NameMatcher(names)
+
+    async def next_speakers(self, conversation: "Conversation") -> List[int]:
+        if self.remaining(conversation) <= 0:
+            return []
+        entries = conversation.transcript.entries
+        if not entries:
+            return [0]
+        lines = [f"{entry['name']}: {entry['content']}" for entry in entries[-MODERATOR_WINDOW:]]
+        timing = CallTiming(self.model, kind="moderator")
+        self.timings.append(timing)
+        try:
+            response = await self.client.chat(self.model, [
+                {'role': 'system', 'content': MODERATOR_INSTRUCTIONS.format(names=", ".join(self.names))},
+                {'role': 'user', 'content': "\n\n".join(lines)},
+            ], timing=timing)
+            choice = response['message']['content']
+        except Exception as e:
+            logger.error(f"Moderator {self.model} failed to pick a speaker: {e}")
+            choice = ""
+        # The first name the moderator mentions other than the last speaker, else the next in order
+        picks = [index for index in self._matcher.mentions(choice) if index != entries[-1]['speaker']]
+        if picks:
+            return picks[:1]
+        return [self.after_last(conversation)]
+
+
+def make_policy(client, config: ImprovedConversationConfig, names: List[str]) -> TurnPolicy:
+    """The turn policy chosen for the conversation; every participant gets `turns` replies on average"""
+    max_replies = config.turns * len(names)
+    if config.turn_policy == "addressed":
+        return AddressedReply(max_replies, names)
+    if config.turn_policy == "moderator":
+        moderator = config.moderator_model or config.participant_configs()[0].model
+        return ModeratorPicks(max_replies, client, moderator, names)
+    return RoundRobin(max_replies)
+
+
+# (participant, its message view) -> the participant's history
+HistoryFactory = Callable[[Participant, TranscriptView], ConversationHistory]
+
+
+class Conversation:
+    """Runs a conversation between participants, overlapping each generation with rendering
+
+    Turns are produced in order by iterating the conversation. Each turn's speaker receives the
+    replies it has not heard yet as user messages, so its generation can start the moment those
+    replies are complete, regardless of how far rendering has got.
+    """
+
+    def __init__(self, client, participants: List[Participant], policy: TurnPolicy,
+                 history: Optional[HistoryFactory] = None, stream: bool = True, preload: bool = False):
+        if len(participants) < 2:
+            raise ValueError("A conversation needs at least two participants")
+        self.client = client
+        self.participants = participants
+        self.policy = policy
+        self.stream = stream
+        self.preload = preload
+        self.transcript = Transcript([participant.name for participant in participants])
+        named = len(participants) > 2
+        for index, participant in enumerate(participants):
+            participant.index = index
+            view = TranscriptView(self.transcript, index, participant.context, named=named)
+            participant.history = history(participant, view) if history else ConversationHistory(view)
+        self.turns: List[Turn] = []
+        self.cancelled = False
+        self.started_at = time.perf_counter()
+        self._task: Optional[asyncio.Task] = None
+        self._preloads: List[asyncio.Task] = []
+        # New turns in order; None once no more will be produced
+        self._new_turns: asyncio.Queue = asyncio.Queue()
+
+    @classmethod
+    def from_config(cls, client, config: ImprovedConversationConfig, stream: Optional[bool] = None,
+                    preload: bool = False) -> "Conversation":
+        """Build the conversation a config describes, with its history and turn policy"""
+        participants = [Participant(p.name, p.model, p.context, options=config.model_options())
+                        for p in config.participant_configs()]
+        policy = make_policy(client, config, [participant.name for participant in participants])
+        return cls(client, participants, policy,
+                   history=lambda participant, messages: make_history(client, config, participant.model, messages),
+                   stream=config.stream_tokens if stream is None else stream, preload=preload)
+
+    @classmethod
+    def alternating(cls, client, first: Participant, second: Participant, rounds: int, **kwargs):
+        """The classic dialogue: first speaker opens, then `rounds` replies from each side,
+        skipping the first speaker's reply in the final round"""
+        return cls(client, [first, second], RoundRobin(2 * rounds), **kwargs)
+
+    def start(self):
+        """Start generating in the background; with preload, the other participants' models
+        are loaded while the first one speaks"""
+        self.started_at = time.perf_counter()
+        if self.preload:
+            models = {self.participants[0].model}
+            for participant in self.participants[1:]:
+                if participant.model not in models and participant.ready is None:
+                    models.add(participant.model)
+                    task = asyncio.create_task(self.client.preload(participant.model))
+                    self._preloads.append(task)
+                    # Everyone using this model waits for the same load
+                    for other in self.participants[1:]:
+                        if other.model == participant.model:
+                            other.ready = task
+        self._task = asyncio.create_task(self._run())
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            turn = await self._new_turns.get()
+            if turn is None:
+                return
+            yield turn
+
+    def timing_summary(self) -> dict:
+        """Per-turn and per-model timings of the turns generated so far, and of the policy's own calls"""
+        timings = [(turn.number, turn.timing) for turn in self.turns if turn.content is not None]
+        summary = summarize_timings(timings, time.perf_counter() - self.started_at)
+        if self.policy.timings:
+            # e.g. the moderator's picks, kept apart from the participants' replies
+            summary["policy_calls"] = [dict(timing.as_dict(), kind=timing.kind) for timing in self.policy.timings]
+        return summary
+
+    def cancel(self):
+        """Stop all generation and release anyone waiting on a turn"""
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        for task in self._preloads:
+            if not task.done():
+                task.cancel()
+        for turn in self.turns:
+            turn._queue.put_nowait(None)
+        for participant in self.participants:
+            participant.history.cancel()
+        self._new_turns.put_nowait(None)
+
+    async def _run(self):
+        try:
+            while not self.cancelled:
+                speakers = await self.policy.next_speakers(self)
+                if not speakers:
+                    break
+                step = []
+                for index in speakers:
+                    participant = self.participants[index]
+                    participant.replies += 1
+                    turn = Turn(len(self.turns), participant, participant.replies)
+                    self.turns.append(turn)
+                    self._new_turns.put_nowait(turn)
+                    step.append(turn)
+                # Speakers chosen together answer the same transcript, so they run concurrently
+                await asyncio.gather(*(self._generate(turn) for turn in step))
+                if any(turn.content is None for turn in step):
+                    break
+                # Pipelining: the next speakers start while these replies are still being rendered
+                for turn in step:
+                    self.transcript.add(turn.speaker.index, turn.content)
+        except Exception as e:
+            logger.error(f"Error choosing the next speaker: {e}")
+        finally:
+            self._new_turns.put_nowait(None)
+
+    async def _generate(self, turn: Turn):
+        speaker = turn.speaker
+        try:
+            if speaker.ready is not None:
+                await speaker.ready
+            messages = speaker.history.prompt()
+            kwargs = {'options': speaker.options} if speaker.options else {}
+            reply = []
+            if self.stream:
+                async for part in self.client.chat_stream(speaker.model, messages, timing=turn.timing, **kwargs):
+                    content = part['message']['content']
+                    if content:
+                        reply.append(content)
+                        turn._queue.put_nowait(content)
+                    if part.get('done'):
+                        turn.response = part
+            else:
+                turn.response = await self.client.chat(speaker.model, messages, timing=turn.timing, **kwargs)
+                reply.append(turn.response['message']['content'])
+                turn._queue.put_nowait(reply[0])
+            turn.content = ''.join(reply)
+        except asyncio.CancelledError:
+            turn._queue.put_nowait(None)
+            raise
+        except Exception as e:
+            logger.error(f"Error generating turn {turn.number} with {speaker.model}: {e}")
+            turn._queue.put_nowait(e)
+            return
+        turn._queue.put_nowait(None)
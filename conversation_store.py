@@ -0,0 +1,350 @@
+"""
+Conversation state storage for AiTalkDual
+Conversations expire after a period of inactivity and the least recently used ones are evicted
+when the store grows past its limits. State can live in memory, in SQLite or in Redis, so that
+several uvicorn workers can serve the same conversation.
+
+    AITALK_STORE=memory                       (default, single process)
+    AITALK_STORE=sqlite:///conversations.db   (shared between workers on one host)
+    AITALK_STORE=redis://localhost:6379/0     (shared between hosts, needs the redis package)
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+DEFAULT_TTL = float(os.getenv("AITALK_STORE_TTL", "3600"))
+DEFAULT_MAX_ENTRIES = int(os.getenv("AITALK_STORE_MAX_ENTRIES", "1000"))
+DEFAULT_MAX_BYTES = int(os.getenv("AITALK_STORE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+
+def estimate_size(conversation: dict) -> int:
+    """Rough memory footprint of a conversation, dominated by its message histories"""
+    size = 256
+    for key, value in conversation.items():
+        if isinstance(value, list):
+            size += sum(len(message.get('content', '')) + 64 for message in value if isinstance(message, dict))
+        elif isinstance(value, dict):
+            size += sum(len(str(item)) for item in value.values())
+        elif isinstance(value, str):
+            size += len(value)
+    return size
+
+
+class ConversationStore:
+    """Interface shared by all conversation stores"""
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.evictions = {"expired": 0, "capacity": 0}
+
+    async def get(self, conversation_id: str) -> Optional[dict]:
+        """Return the conversation, or None if it does not exist or has expired"""
+        raise NotImplementedError
+
+    async def add(self, conversation_id: str, conversation: dict):
+        """Insert or replace a conversation"""
+        raise NotImplementedError
+
+    async def update(self, conversation_id: str, conversation: dict) -> bool:
+        """Save a conversation only if it still exists; returns False if it was deleted"""
+        raise NotImplementedError
+
+    async def delete(self, conversation_id: str) -> bool:
+        """Remove a conversation; returns False if it did not exist"""
+        raise NotImplementedError
+
+    async def stats(self) -> Dict[str, int]:
+        """Size and eviction counters"""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class MemoryConversationStore(ConversationStore):
+    """In-process store with TTL and LRU eviction under an entry count and memory cap"""
+
+    def __init__(self, **limits):
+        super().__init__(**limits)
+        # conversation_id -> (conversation, size, last_access), oldest access first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+
+    def _expired(self, last_access: float, now: float) -> bool:
+        return bool(self.ttl) and now - last_access > self.ttl
+
+    def _remove(self, conversation_id: str):
+        _, size, _ = self._entries.pop(conversation_id)
+        self._bytes -= size
+
+    def _store(self, conversation_id: str, conversation: dict):
+        if conversation_id in self._entries:
+            self._remove(conversation_id)
+        size = estimate_size(conversation)
+        self._entries[conversation_id] = (conversation, size, time.time())
+        self._bytes += size
+        self._evict()
+
+    def _evict(self):
+        now = time.time()
+        # Entries are ordered by last access, so expired ones sit at the front
+        while self._entries:
+            conversation_id, (_, _, last_access) = next(iter(self._entries.items()))
+            if not self._expired(last_access, now):
+                break
+            self._remove(conversation_id)
+            self.evictions["expired"] += 1
+        # Over capacity: drop least recently used conversations that are not streaming
+        if len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            for conversation_id, (conversation, _, _) in list(self._entries.items()):
+                if len(self._entries) <= self.max_entries and self._bytes <= self.max_bytes:
+                    break
+                if conversation.get("is_running"):
+                    continue
+                self._remove(conversation_id)
+                self.evictions["capacity"] += 1
+
+    async def get(self, conversation_id: str) -> Optional[dict]:
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        conversation, size, last_access = entry
+        if self._expired(last_access, time.time()):
+            self._remove(conversation_id)
+            self.evictions["expired"] += 1
+            return None
+        self._entries[conversation_id] = (conversation, size, time.time())
+        self._entries.move_to_end(conversation_id)
+        return conversation
+
+    async def add(self, conversation_id: str, conversation: dict):
+        self._store(conversation_id, conversation)
+
+    async def update(self, conversation_id: str, conversation: dict) -> bool:
+        if conversation_id not in self._entries:
+            return False
+        self._store(conversation_id, conversation)
+        return True
+
+    async def delete(self, conversation_id: str) -> bool:
+        if conversation_id not in self._entries:
+            return False
+        self._remove(conversation_id)
+        return True
+
+    async def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "bytes": self._bytes,
+            "evictions_expired": self.evictions["expired"],
+            "evictions_capacity": self.evictions["capacity"],
+        }
+
+
+class SQLiteConversationStore(ConversationStore):
+    """On-disk store that survives restarts and can be shared by worker processes"""
+
+    def __init__(self, path: str, **limits):
+        super().__init__(**limits)
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                is_running INTEGER NOT NULL DEFAULT 0,
+                last_access REAL NOT NULL
+            )""")
+        self._db.execute("CREATE INDEX IF NOT EXISTS conversations_last_access ON conversations (last_access)")
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(self._locked, fn, *args)
+
+    def _locked(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _get(self, conversation_id):
+        row = self._db.execute("SELECT data, last_access FROM conversations WHERE id = ?",
+                               (conversation_id,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if self.ttl and now - row[1] > self.ttl:
+            self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            self.evictions["expired"] += 1
+            return None
+        self._db.execute("UPDATE conversations SET last_access = ? WHERE id = ?", (now, conversation_id))
+        return json.loads(row[0])
+
+    def _put(self, conversation_id, conversation, only_existing):
+        data = json.dumps(conversation)
+        args = (data, len(data), int(bool(conversation.get("is_running"))), time.time(), conversation_id)
+        if only_existing:
+            cursor = self._db.execute(
+                "UPDATE conversations SET data = ?, size = ?, is_running = ?, last_access = ? WHERE id = ?", args)
+            if cursor.rowcount == 0:
+                return False
+        else:
+            self._db.execute(
+                "INSERT OR REPLACE INTO conversations (data, size, is_running, last_access, id) VALUES (?, ?, ?, ?, ?)",
+                args)
+        self._evict()
+        return True
+
+    def _evict(self):
+        if self.ttl:
+            cursor = self._db.execute("DELETE FROM conversations WHERE last_access < ?", (time.time() - self.ttl,))
+            self.evictions["expired"] += max(cursor.rowcount, 0)
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM conversations").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        rows = self._db.execute(
+            "SELECT id, size FROM conversations WHERE is_running = 0 ORDER BY last_access").fetchall()
+        for conversation_id, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            count -= 1
+            total -= size
+            self.evictions["capacity"] += 1
+
+    def _delete(self, conversation_id):
+        return self._db.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount > 0
+
+    def _stats(self):
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM conversations").fetchone()
+        return {
+            "size": count,
+            "bytes": total,
+            "evictions_expired": self.evictions["expired"],
+            "evictions_capacity": self.evictions["capacity"],
+        }
+
+    async def get(self, conversation_id: str) -> Optional[dict]:
+        return await self._run(self._get, conversation_id)
+
+    async def add(self, conversation_id: str, conversation: dict):
+        await self._run(self._put, conversation_id, conversation, False)
+
+    async def update(self, conversation_id: str, conversation: dict) -> bool:
+        return await self._run(self._put, conversation_id, conversation, True)
+
+    async def delete(self, conversation_id: str) -> bool:
+        return await self._run(self._delete, conversation_id)
+
+    async def stats(self) -> Dict[str, int]:
+        return await self._run(self._stats)
+
+    async def close(self):
+        await self._run(self._db.close)
+
+
+class RedisConversationStore(ConversationStore):
+    """Store backed by Redis or any server speaking its protocol
+
+    Redis expires idle conversations itself; a sorted set of last access times
+    drives LRU eviction once max_entries is exceeded.
+    """
+
+    def __init__(self, url: str, prefix: str = "aitalk", **limits):
+        super().__init__(**limits)
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("The redis package is required for a redis:// store: pip install redis") from e
+        self._redis = redis.Redis.from_url(url, decode_responses=True)
+        self._prefix = prefix
+        self._index = f"{prefix}:conversations"
+
+    def _key(self, conversation_id: str) -> str:
+        return f"{self._prefix}:conversation:{conversation_id}"
+
+    async def _save(self, conversation_id: str, conversation: dict, only_existing: bool) -> bool:
+        data = json.dumps(conversation)
+        saved = await self._redis.set(self._key(conversation_id), data,
+                                      ex=int(self.ttl) if self.ttl else None, xx=only_existing)
+        if not saved:
+            return False
+        await self._redis.zadd(self._index, {conversation_id: time.time()})
+        await self._evict()
+        return True
+
+    async def _evict(self):
+        if self.ttl:
+            # Index entries whose keys Redis has already expired
+            expired = await self._redis.zremrangebyscore(self._index, 0, time.time() - self.ttl)
+            self.evictions["expired"] += expired
+        excess = await self._redis.zcard(self._index) - self.max_entries
+        if excess <= 0:
+            return
+        # Walk from the least recently used end, skipping conversations that are streaming
+        start = 0
+        while excess > 0:
+            batch = await self._redis.zrange(self._index, start, start + excess - 1)
+            if not batch:
+                break
+            for conversation_id in batch:
+                data = await self._redis.get(self._key(conversation_id))
+                if data is not None and json.loads(data).get("is_running"):
+                    start += 1
+                    continue
+                await self._redis.delete(self._key(conversation_id))
+                await self._redis.zrem(self._index, conversation_id)
+                self.evictions["capacity"] += 1
+                excess -= 1
+
+    async def get(self, conversation_id: str) -> Optional[dict]:
+        data = await self._redis.get(self._key(conversation_id))
+        if data is None:
+            await self._redis.zrem(self._index, conversation_id)
+            return None
+        if self.ttl:
+            await self._redis.expire(self._key(conversation_id), int(self.ttl))
+        await self._redis.zadd(self._index, {conversation_id: time.time()})
+        return json.loads(data)
+
+    async def add(self, conversation_id: str, conversation: dict):
+        await self._save(conversation_id, conversation, False)
+
+    async def update(self, conversation_id: str, conversation: dict) -> bool:
+        return await self._save(conversation_id, conversation, True)
+
+    async def delete(self, conversation_id: str) -> bool:
+        await self._redis.zrem(self._index, conversation_id)
+        return await self._redis.delete(self._key(conversation_id)) > 0
+
+    async def stats(self) -> Dict[str, int]:
+        return {
+            "size": await self._redis.zcard(self._index),
+            "evictions_expired": self.evictions["expired"],
+            "evictions_capacity": self.evictions["capacity"],
+        }
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_store(url: Optional[str] = None, **limits) -> ConversationStore:
+    """Create a conversation store from a URL such as sqlite:///conversations.db"""
+    url = url or os.getenv("AITALK_STORE", "memory")
+    if url == "memory":
+        return MemoryConversationStore(**limits)
+    if url.startswith("sqlite:///"):
+        return SQLiteConversationStore(url[len("sqlite:///"):], **limits)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisConversationStore(url, **limits)
+    raise ValueError(f"Unsupported conversation store: {url}")
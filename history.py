@@ -0,0 +1,224 @@
+"""
+Context-window management for long dialogues
+Each model's history keeps a pinned system prompt and a token-budgeted sliding window of recent
+messages. Messages that fall out of the window can be folded into a rolling summary in the background.
+
+In a conversation, every reply is stored once in a shared Transcript; each participant's history
+reads it through a TranscriptView, so memory grows with the number of replies, not with
+replies times listeners.
+"""
+
+import asyncio
+import logging
+from collections.abc import Sequence
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from metrics import CallTiming
+
+logger = logging.getLogger(__name__)
+
+# Summarizer signature: (previous summary or None, newly evicted messages) -> new summary
+Summarizer = Callable[[Optional[str], List[dict]], Awaitable[str]]
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+SUMMARY_INSTRUCTIONS = ("Summarize the following conversation in a few sentences from the point of view of "
+                        "'You'. Keep names, facts and open questions. Reply with the summary only.")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+class Transcript:
+    """Every reply of a conversation in order, stored once for all participants"""
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        # {'speaker': participant index, 'name': ..., 'content': ...}; kept as plain dicts so the
+        # list can be saved with the conversation
+        self.entries: List[dict] = []
+        self.tokens: List[int] = []
+        self.histories: List["ConversationHistory"] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, speaker: int, content: str):
+        self.entries.append({'speaker': speaker, 'name': self.names[speaker], 'content': content})
+        self.tokens.append(estimate_tokens(content))
+        for history in self.histories:
+            history.sync()
+
+
+class TranscriptView(Sequence):
+    """One participant's messages, built on access from the shared transcript
+
+    The participant's private system prompt comes first; its own replies are 'assistant'
+    messages and everyone else's are 'user' messages. With more than two participants, other
+    replies are prefixed with the speaker's name so the model can tell them apart.
+    """
+
+    def __init__(self, transcript: Transcript, participant: int, context: str, named: bool = False):
+        self.transcript = transcript
+        self.participant = participant
+        self.named = named
+        self._system = {'role': 'system', 'content': context}
+        self.tokens = _ViewTokens(self)
+
+    def __len__(self) -> int:
+        return len(self.transcript) + 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index == 0:
+            return self._system
+        entry = self.transcript.entries[index - 1]
+        if entry['speaker'] == self.participant:
+            return {'role': 'assistant', 'content': entry['content']}
+        if self.named:
+            return {'role': 'user', 'content': f"{entry['name']}: {entry['content']}"}
+        return {'role': 'user', 'content': entry['content']}
+
+
+class _ViewTokens(Sequence):
+    """Token counts of a TranscriptView's messages, read from the transcript"""
+
+    def __init__(self, view: TranscriptView):
+        self.view = view
+        self._system = estimate_tokens(view._system['content'])
+        self._names: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.view)
+
+    def __getitem__(self, index: int) -> int:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index == 0:
+            return self._system
+        transcript = self.view.transcript
+        speaker = transcript.entries[index - 1]['speaker']
+        tokens = transcript.tokens[index - 1]
+        if self.view.named and speaker != self.view.participant:
+            if speaker not in self._names:
+                self._names[speaker] = estimate_tokens(transcript.names[speaker] + ": ") - 1
+            tokens += self._names[speaker]
+        return tokens
+
+
+class ConversationHistory:
+    """A model's message history, sent to the model through a sliding window
+
+    `messages` is the full record and is appended to in place; token counts are cached per
+    message, so adding a turn never re-measures the whole history. It may also be a
+    TranscriptView, which the shared transcript extends; the history follows it via sync().
+    """
+
+    def __init__(self, messages: List[dict], max_tokens: Optional[int] = None,
+                 summarizer: Optional[Summarizer] = None):
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.summary: Optional[str] = None
+        if isinstance(messages, TranscriptView):
+            self._tokens = messages.tokens
+            messages.transcript.histories.append(self)
+        else:
+            self._tokens = [estimate_tokens(message['content']) for message in messages]
+        self._pinned = 1 if messages and messages[0]['role'] == 'system' else 0
+        self._pinned_tokens = self._tokens[0] if self._pinned else 0
+        self._window_start = self._pinned
+        self._window_tokens = 0
+        self._synced = self._pinned
+        self._summary_tokens = 0
+        self._pending: List[dict] = []
+        self._summary_task: Optional[asyncio.Task] = None
+        self.sync()
+
+    @property
+    def token_count(self) -> int:
+        """Estimated size of the prompt that prompt() returns"""
+        return self._pinned_tokens + self._summary_tokens + self._window_tokens
+
+    def append(self, role: str, content: str):
+        self.messages.append({'role': role, 'content': content})
+        self._tokens.append(estimate_tokens(content))
+        self.sync()
+
+    def sync(self):
+        """Take in the messages added to `messages` since the last call"""
+        while self._synced < len(self.messages):
+            self._window_tokens += self._tokens[self._synced]
+            self._synced += 1
+        self._trim()
+
+    def prompt(self) -> List[dict]:
+        """Messages to send to the model: system prompt, rolling summary and recent window"""
+        prompt = self.messages[:self._pinned]
+        if self.summary:
+            prompt.append({'role': 'system', 'content': SUMMARY_PREFIX + self.summary})
+        prompt.extend(self.messages[self._window_start:])
+        return prompt
+
+    def _trim(self):
+        if not self.max_tokens:
+            return
+        budget = self.max_tokens - self._pinned_tokens - self._summary_tokens
+        # Always keep the latest message, even if it alone exceeds the budget
+        while self._window_tokens > budget and self._window_start < len(self.messages) - 1:
+            self._pending.append(self.messages[self._window_start])
+            self._window_tokens -= self._tokens[self._window_start]
+            self._window_start += 1
+        if self._pending and self.summarizer is not None and self._summary_task is None:
+            self._summary_task = asyncio.create_task(self._summarize())
+        elif self._pending and self.summarizer is None:
+            self._pending.clear()
+
+    def _set_summary(self, summary: str):
+        """Store a new summary, cut so that it and the pinned prompt leave room for the latest message"""
+        if self.max_tokens:
+            latest = self._tokens[len(self.messages) - 1] if len(self.messages) > self._pinned else 0
+            room = self.max_tokens - self._pinned_tokens - latest
+            if estimate_tokens(SUMMARY_PREFIX + summary) > room:
+                summary = summary[:max(0, (room - 1) * 4 - len(SUMMARY_PREFIX))]
+        self.summary = summary or None
+        self._summary_tokens = estimate_tokens(SUMMARY_PREFIX + summary) if summary else 0
+
+    async def _summarize(self):
+        try:
+            while self._pending:
+                evicted, self._pending = self._pending, []
+                self._set_summary(await self.summarizer(self.summary, evicted))
+                # A longer summary leaves less room for the window; what it pushes out is
+                # summarized by the next pass of this loop
+                self._trim()
+        except Exception as e:
+            logger.error(f"Error summarizing history: {e}")
+        finally:
+            self._summary_task = None
+
+    def cancel(self):
+        """Stop any background summarization"""
+        if self._summary_task is not None:
+            self._summary_task.cancel()
+
+
+def model_summarizer(client, model: str) -> Summarizer:
+    """Summarize evicted messages with the given model through an InferenceClient"""
+    async def summarize(previous: Optional[str], evicted: List[dict]) -> str:
+        lines = [f"Earlier summary: {previous}"] if previous else []
+        for message in evicted:
+            speaker = "You" if message['role'] == 'assistant' else "Partner"
+            lines.append(f"{speaker}: {message['content']}")
+        response = await client.chat(model, [
+            {'role': 'system', 'content': SUMMARY_INSTRUCTIONS},
+            {'role': 'user', 'content': "\n".join(lines)},
+        ], timing=CallTiming(model, kind="summary"))
+        return response['message']['content'].strip()
+    return summarize
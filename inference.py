@@ -0,0 +1,387 @@
+"""
+Async inference layer for AiTalkDual
+All model calls share pooled connections to one or more Ollama hosts and never block the event loop.
+With several backends, each call goes to the host where the model is already loaded unless that
+host is saturated, then to the one with the fewest outstanding requests; connection failures fail
+over to the next host.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set
+
+import httpx
+import ollama
+
+import metrics
+from metrics import CallTiming
+from model_registry import normalize_models
+from response_cache import ResponseCache, cache_key, cacheable_response
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden through the environment, e.g.
+#   AITALK_MODEL_CONCURRENCY=2  (per model on each backend)
+#   AITALK_MODEL_LIMITS="qwen2:1.5b=1,llama3.2:1b=3"  (likewise per backend)
+#   AITALK_REQUEST_TIMEOUT=300
+#   AITALK_KEEP_ALIVE=10m
+#   AITALK_BACKENDS="http://gpu1:11434 max=4; http://gpu2:11434 max=2 models=qwen2:1.5b"
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("AITALK_MODEL_CONCURRENCY", "2"))
+DEFAULT_REQUEST_TIMEOUT = float(os.getenv("AITALK_REQUEST_TIMEOUT", "300"))
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("AITALK_MAX_CONNECTIONS", "32"))
+DEFAULT_KEEP_ALIVE = os.getenv("AITALK_KEEP_ALIVE") or None
+# Seconds between backend health checks, and before a failed backend is tried again
+HEALTH_INTERVAL = float(os.getenv("AITALK_BACKEND_HEALTH_INTERVAL", "10"))
+RETRY_AFTER = float(os.getenv("AITALK_BACKEND_RETRY", "10"))
+
+# Errors meaning the host could not be reached or dropped the connection without replying
+CONNECTION_ERRORS = (ConnectionError, httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+def parse_model_limits(spec: Optional[str]) -> Dict[str, int]:
+    """Parse a "model=limit,model=limit" string into a dict"""
+    limits: Dict[str, int] = {}
+    if not spec:
+        return limits
+    for item in spec.split(","):
+        name, sep, value = item.strip().rpartition("=")
+        if not sep or not name:
+            continue
+        try:
+            limits[name] = max(1, int(value))
+        except ValueError:
+            logger.warning(f"Ignoring invalid model limit: {item}")
+    return limits
+
+
+def parse_backends(spec: Optional[str]) -> List[dict]:
+    """Parse "host [max=N] [models=a,b]; host ..." into Backend keyword arguments"""
+    backends = []
+    for item in (spec or "").split(";"):
+        fields = item.split()
+        if not fields:
+            continue
+        backend = {"host": fields[0]}
+        for field in fields[1:]:
+            key, _, value = field.partition("=")
+            if key == "max" and value.isdigit():
+                backend["max_concurrency"] = max(1, int(value))
+            elif key == "models" and value:
+                backend["models"] = set(value.split(","))
+            else:
+                logger.warning(f"Ignoring invalid backend option: {field}")
+        backends.append(backend)
+    return backends
+
+
+class Backend:
+    """One Ollama host together with what the router knows about it"""
+
+    def __init__(self, host: Optional[str] = None, models: Optional[Set[str]] = None,
+                 max_concurrency: int = DEFAULT_MAX_CONNECTIONS, timeout: float = DEFAULT_REQUEST_TIMEOUT,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS):
+        self.host = host
+        self.name = host or "default"
+        # Models this host may serve; None allows everything it has installed
+        self.models = models
+        self.max_concurrency = max_concurrency
+        self.client = ollama.AsyncClient(
+            host=host,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections),
+        )
+        self.outstanding = 0
+        self.outstanding_by_model: Dict[str, int] = {}
+        self.installed: Optional[Set[str]] = None  # from /api/tags, None until listed
+        self.loaded: Set[str] = set()  # from /api/ps and the calls sent to it
+        self.down_until = 0.0
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.down_until
+
+    def serves(self, model: str) -> bool:
+        return ((self.models is None or model in self.models)
+                and (self.installed is None or model in self.installed))
+
+    def mark_down(self, error: Exception):
+        logger.warning(f"Ollama backend {self.name} unreachable: {error}")
+        self.down_until = time.monotonic() + RETRY_AFTER
+
+    async def check(self):
+        """Refresh health and the set of loaded models from /api/ps"""
+        try:
+            response = await asyncio.wait_for(self.client.ps(), timeout=10.0)
+        except Exception as e:
+            if self.healthy:
+                self.mark_down(e)
+            return
+        self.down_until = 0.0
+        self.loaded = {model["name"] for model in normalize_models(response)}
+
+
+class InferenceClient:
+    """Non-blocking Ollama client with backend routing, per-model concurrency limits and timeouts"""
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        model_concurrency: int = DEFAULT_MODEL_CONCURRENCY,
+        model_limits: Optional[Dict[str, int]] = None,
+        timeout: float = DEFAULT_REQUEST_TIMEOUT,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        response_cache: Optional[ResponseCache] = None,
+        backends: Optional[List[dict]] = None,
+    ):
+        self.host = host
+        self.model_concurrency = model_concurrency
+        self.model_limits = dict(model_limits if model_limits is not None
+                                 else parse_model_limits(os.getenv("AITALK_MODEL_LIMITS")))
+        self.timeout = timeout
+        self.response_cache = response_cache
+        if backends is None:
+            backends = [] if host else parse_backends(os.getenv("AITALK_BACKENDS"))
+        # One httpx pool per host, shared by every conversation and endpoint
+        self.backends = [Backend(timeout=timeout, max_connections=max_connections, **backend)
+                         for backend in backends or [{"host": host}]]
+        self._health_task: Optional[asyncio.Task] = None
+
+    @asynccontextmanager
+    async def _slot(self, backend: Backend, model: str):
+        """Hold one of the backend's slots for the model, then one of the backend's own slots
+
+        Model limits are kept per backend, since each host generates with its own memory.
+        """
+        semaphore = backend._semaphores.get(model)
+        if semaphore is None:
+            semaphore = backend._semaphores[model] = asyncio.Semaphore(self._model_limit(model))
+        backend.outstanding += 1
+        backend.outstanding_by_model[model] = backend.outstanding_by_model.get(model, 0) + 1
+        # Counted as loaded from now on, so later calls join this host instead of loading elsewhere
+        backend.loaded.add(model)
+        try:
+            # The model's limit is waited for first, so a call queued behind its own model never
+            # holds a host slot that another model could generate in
+            async with semaphore, backend._slots:
+                yield
+        finally:
+            backend.outstanding -= 1
+            backend.outstanding_by_model[model] -= 1
+
+    def _model_limit(self, model: str) -> int:
+        return self.model_limits.get(model, self.model_concurrency)
+
+    def _pick(self, model: str, tried: List[Backend]) -> Backend:
+        """Choose a backend: healthy, serving the model, already holding it in memory, least busy
+
+        A host is saturated for the model once it runs as many calls as it allows in total or
+        for that model. Among saturated hosts the least busy one is chosen, loaded or not.
+        """
+        candidates = [b for b in self.backends if b not in tried]
+        candidates = [b for b in candidates if b.serves(model)] or candidates
+        candidates = [b for b in candidates if b.healthy] or candidates
+        limit = self._model_limit(model)
+
+        def score(backend: Backend):
+            saturated = (backend.outstanding >= backend.max_concurrency
+                         or backend.outstanding_by_model.get(model, 0) >= limit)
+            return (saturated,
+                    not saturated and model not in backend.loaded,
+                    backend.outstanding / backend.max_concurrency)
+        return min(candidates, key=score)
+
+    def _fail_over(self, backend: Backend, tried: List[Backend], error: Exception) -> bool:
+        """Take a backend out of rotation; returns whether another one is left to try"""
+        backend.mark_down(error)
+        tried.append(backend)
+        return len(tried) < len(self.backends)
+
+    async def _cached(self, key: Optional[str], timing: CallTiming):
+        """Look up a reply in the response cache, recording a hit on the timing"""
+        if key is None:
+            return None
+        started = time.perf_counter()
+        response = await asyncio.to_thread(self.response_cache.get, key)
+        if response is not None:
+            timing.status = "cached"
+            timing.generation_time = timing.time_to_first_token = time.perf_counter() - started
+            timing.update_from_response(response)
+            metrics.observe(timing)
+        return response
+
+    async def _call(self, model: str, timing: CallTiming, request, first_token: bool = False):
+        """Run request(client) on the best backend for the model, failing over on connection errors
+
+        With first_token, the whole reply counts as the first token, as for a non-streamed chat.
+        """
+        tried: List[Backend] = []
+        queued = started = time.perf_counter()
+        try:
+            while True:
+                backend = self._pick(model, tried)
+                timing.backend = backend.name
+                async with self._slot(backend, model):
+                    started = time.perf_counter()
+                    timing.queue_wait = started - queued
+                    try:
+                        response = await asyncio.wait_for(request(backend.client), timeout=self.timeout)
+                    except CONNECTION_ERRORS as e:
+                        if self._fail_over(backend, tried, e):
+                            continue
+                        raise
+                break
+        except BaseException as e:
+            timing.status = "cancelled" if isinstance(e, asyncio.CancelledError) else "error"
+            raise
+        else:
+            timing.generation_time = time.perf_counter() - started
+            if first_token:
+                timing.time_to_first_token = timing.generation_time
+            timing.update_from_response(response)
+            return response
+        finally:
+            metrics.observe(timing)
+
+    async def cached(self, model: str, messages: List[dict], timing: Optional[CallTiming] = None, **kwargs):
+        """The cached reply to a chat call with these arguments, or None
+
+        Lets a caller that queues model calls serve a hit without queueing; the hit is recorded
+        on the timing like one served by chat().
+        """
+        if self.response_cache is None:
+            return None
+        return await self._cached(cache_key(model, messages, **kwargs), timing or CallTiming(model))
+
+    async def chat(self, model: str, messages: List[dict], timing: Optional[CallTiming] = None,
+                   lookup: bool = True, **kwargs):
+        """Run a single chat completion without blocking the event loop
+
+        Pass a CallTiming to receive the call's latency and token counts. lookup=False skips the
+        cache lookup after the caller has just missed with cached(); the reply is still stored.
+        """
+        timing = timing or CallTiming(model)
+        key = cache_key(model, messages, **kwargs) if self.response_cache is not None else None
+        cached = await self._cached(key, timing) if lookup else None
+        if cached is not None:
+            return cached
+        response = await self._call(model, timing, lambda client: client.chat(model=model, messages=messages, **kwargs),
+                                    first_token=True)
+        if key is not None:
+            await asyncio.to_thread(self.response_cache.put, key, cacheable_response(response))
+        return response
+
+    async def chat_stream(self, model: str, messages: List[dict], timing: Optional[CallTiming] = None,
+                          lookup: bool = True, **kwargs):
+        """Yield response parts as the model generates them
+
+        The timeout applies to the gap between two parts rather than to the whole reply.
+        A cached reply is yielded as a single final part. Failover only happens before the
+        first part, so a reply is never stitched together from two hosts. lookup works as
+        for chat().
+        """
+        timing = timing or CallTiming(model)
+        key = cache_key(model, messages, **kwargs) if self.response_cache is not None else None
+        cached = await self._cached(key, timing) if lookup else None
+        if cached is not None:
+            yield cached
+            return
+        final = None
+        reply = []
+        tried: List[Backend] = []
+        queued = started = time.perf_counter()
+        try:
+            while True:
+                backend = self._pick(model, tried)
+                timing.backend = backend.name
+                retry = False
+                async with self._slot(backend, model):
+                    started = time.perf_counter()
+                    timing.queue_wait = started - queued
+                    stream = await backend.client.chat(model=model, messages=messages, stream=True, **kwargs)
+                    try:
+                        received = False
+                        while True:
+                            try:
+                                part = await asyncio.wait_for(stream.__anext__(), timeout=self.timeout)
+                            except StopAsyncIteration:
+                                break
+                            except CONNECTION_ERRORS as e:
+                                if received or not self._fail_over(backend, tried, e):
+                                    raise
+                                retry = True
+                                break
+                            received = True
+                            content = part['message']['content']
+                            if timing.time_to_first_token is None and content:
+                                timing.time_to_first_token = time.perf_counter() - started
+                            if key is not None:
+                                reply.append(content)
+                            if part.get('done'):
+                                timing.update_from_response(part)
+                                final = part
+                            yield part
+                    finally:
+                        await stream.aclose()
+                if not retry:
+                    break
+        except BaseException as e:
+            # GeneratorExit means the consumer stopped reading early
+            timing.status = "error" if isinstance(e, Exception) else "cancelled"
+            raise
+        finally:
+            timing.generation_time = time.perf_counter() - started
+            metrics.observe(timing)
+        if key is not None and final is not None:
+            await asyncio.to_thread(self.response_cache.put, key, cacheable_response(final, ''.join(reply)))
+
+    async def preload(self, model: str, keep_alive: Optional[str] = DEFAULT_KEEP_ALIVE):
+        """Load a model into memory without generating anything"""
+        timing = CallTiming(model, kind="preload")
+        return await self._call(model, timing, lambda client: client.generate(
+            model=model, prompt='', keep_alive=keep_alive))
+
+    async def list_models(self):
+        """Return the models installed on any reachable backend, in Ollama's list format"""
+        results = await asyncio.gather(
+            *(asyncio.wait_for(backend.client.list(), timeout=self.timeout) for backend in self.backends),
+            return_exceptions=True)
+        models = {}
+        errors = []
+        for backend, result in zip(self.backends, results):
+            if isinstance(result, BaseException):
+                errors.append(result)
+                if isinstance(result, CONNECTION_ERRORS):
+                    backend.mark_down(result)
+                continue
+            installed = normalize_models(result)
+            backend.installed = {model["name"] for model in installed}
+            for model in installed:
+                if backend.models is None or model["name"] in backend.models:
+                    models.setdefault(model["name"], model)
+        if errors and not models:
+            raise errors[0]
+        return {"models": list(models.values())}
+
+    async def _check_forever(self):
+        while True:
+            await asyncio.gather(*(backend.check() for backend in self.backends))
+            await asyncio.sleep(HEALTH_INTERVAL)
+
+    def start(self):
+        """Check backend health and loaded models in the background when routing between hosts"""
+        if len(self.backends) > 1 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._check_forever())
+
+    async def aclose(self):
+        """Stop health checks and close the pooled HTTP connections"""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for backend in self.backends:
+            await backend.client._client.aclose()
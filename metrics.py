@@ -0,0 +1,248 @@
+"""
+Latency and token throughput instrumentation for model calls
+Every call records queue wait, time to first token, generation time, model load time and
+prompt/eval token rates. Metrics are exported in the Prometheus text format without extra
+dependencies, and per-conversation summaries are built from the same timings.
+"""
+
+import asyncio
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+NANOSECONDS = 1e9
+
+# Histogram buckets in seconds, covering fast cached replies up to slow cold starts
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Event loop lag buckets in seconds; anything above a few milliseconds delays every stream
+LAG_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+class CallTiming:
+    """Timing and token counts of a single model call
+
+    `status` is one of ok, error, cancelled or cached (served from the response cache).
+    """
+
+    def __init__(self, model: str, kind: str = "chat"):
+        self.model = model
+        self.kind = kind
+        self.status = "ok"
+        self.backend: Optional[str] = None  # Ollama host that served the call
+        self.queue_wait = 0.0
+        self.time_to_first_token: Optional[float] = None
+        self.generation_time = 0.0
+        self.load_time = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.prompt_eval_time = 0.0
+        self.eval_time = 0.0
+
+    def update_from_response(self, response):
+        """Copy Ollama's token counts and durations from a final response"""
+        self.load_time = (response.get('load_duration') or 0) / NANOSECONDS
+        self.prompt_tokens = response.get('prompt_eval_count') or 0
+        self.completion_tokens = response.get('eval_count') or 0
+        self.prompt_eval_time = (response.get('prompt_eval_duration') or 0) / NANOSECONDS
+        self.eval_time = (response.get('eval_duration') or 0) / NANOSECONDS
+
+    @property
+    def prompt_tokens_per_second(self) -> Optional[float]:
+        return self.prompt_tokens / self.prompt_eval_time if self.prompt_eval_time else None
+
+    @property
+    def eval_tokens_per_second(self) -> Optional[float]:
+        return self.completion_tokens / self.eval_time if self.eval_time else None
+
+    def as_dict(self) -> dict:
+        def rounded(value):
+            return round(value, 4) if value is not None else None
+        return {
+            "model": self.model,
+            "backend": self.backend,
+            "status": self.status,
+            "queue_wait_s": rounded(self.queue_wait),
+            "time_to_first_token_s": rounded(self.time_to_first_token),
+            "generation_s": rounded(self.generation_time),
+            "load_s": rounded(self.load_time),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "prompt_tokens_per_s": rounded(self.prompt_tokens_per_second),
+            "eval_tokens_per_s": rounded(self.eval_tokens_per_second),
+        }
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help = help_text
+        self.kind = "counter"
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(sorted(labels.items()))
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield self.name, labels, value
+
+
+class Gauge(Counter):
+    def __init__(self, name: str, help_text: str):
+        super().__init__(name, help_text)
+        self.kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.kind = "histogram"
+        self.buckets = buckets
+        # labels -> [bucket counts..., sum, count]
+        self._values: Dict[Tuple, List[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[i] += 1
+        entry[-2] += value
+        entry[-1] += 1
+
+    def samples(self):
+        for labels, entry in self._values.items():
+            for i, bound in enumerate(self.buckets):
+                yield f"{self.name}_bucket", labels + (("le", repr(bound)),), entry[i]
+            yield f"{self.name}_bucket", labels + (("le", "+Inf"),), entry[-1]
+            yield f"{self.name}_sum", labels, entry[-2]
+            yield f"{self.name}_count", labels, entry[-1]
+
+
+class MetricsRegistry:
+    """Process-wide collection of metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        # Held while observing and rendering, as calls may be recorded from worker threads
+        self.lock = threading.Lock()
+        self._metrics: List = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self, extra: Iterable = ()) -> str:
+        lines = []
+        with self.lock:
+            for metric in list(self._metrics) + list(extra):
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.kind}")
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+model_requests = REGISTRY.register(Counter(
+    "aitalk_model_requests_total", "Model calls by model, kind and outcome"))
+queue_wait_seconds = REGISTRY.register(Histogram(
+    "aitalk_model_queue_wait_seconds", "Time a call waited for a free model slot"))
+time_to_first_token_seconds = REGISTRY.register(Histogram(
+    "aitalk_model_time_to_first_token_seconds", "Time from sending a request to its first token"))
+generation_seconds = REGISTRY.register(Histogram(
+    "aitalk_model_generation_seconds", "Wall-clock time of a model call"))
+load_seconds = REGISTRY.register(Histogram(
+    "aitalk_model_load_seconds", "Time Ollama spent loading the model for a call"))
+prompt_tokens = REGISTRY.register(Counter(
+    "aitalk_model_prompt_tokens_total", "Prompt tokens evaluated"))
+prompt_eval_seconds = REGISTRY.register(Counter(
+    "aitalk_model_prompt_eval_seconds_total", "Time spent evaluating prompts; tokens/s = tokens / seconds"))
+completion_tokens = REGISTRY.register(Counter(
+    "aitalk_model_completion_tokens_total", "Tokens generated"))
+eval_seconds = REGISTRY.register(Counter(
+    "aitalk_model_eval_seconds_total", "Time spent generating tokens; tokens/s = tokens / seconds"))
+backend_requests = REGISTRY.register(Counter(
+    "aitalk_backend_requests_total", "Model calls by Ollama backend and outcome"))
+response_cache_requests = REGISTRY.register(Counter(
+    "aitalk_response_cache_requests_total", "Response cache lookups by result; hit rate = hit / (hit + miss)"))
+event_loop_lag_seconds = REGISTRY.register(Histogram(
+    "aitalk_event_loop_lag_seconds", "How late the event loop woke up for a timer, a sign of blocking work",
+    LAG_BUCKETS))
+scheduler_wait_seconds = REGISTRY.register(Histogram(
+    "aitalk_scheduler_wait_seconds", "Time a conversation turn waited for the turn scheduler"))
+scheduler_rejections = REGISTRY.register(Counter(
+    "aitalk_scheduler_rejections_total", "Conversations refused because the server was saturated"))
+
+async def watch_event_loop(interval: float = 0.1):
+    """Record the event loop's lag every `interval` seconds until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - started - interval)
+        with REGISTRY.lock:
+            event_loop_lag_seconds.observe(lag)
+
+
+def observe(timing: CallTiming):
+    """Record a finished model call"""
+    model = timing.model
+    with REGISTRY.lock:
+        model_requests.inc(model=model, kind=timing.kind, status=timing.status)
+        if timing.status == "cached":
+            return
+        if timing.backend is not None:
+            backend_requests.inc(backend=timing.backend, status=timing.status)
+        queue_wait_seconds.observe(timing.queue_wait, model=model)
+        if timing.status != "ok":
+            return
+        generation_seconds.observe(timing.generation_time, model=model, kind=timing.kind)
+        if timing.time_to_first_token is not None:
+            time_to_first_token_seconds.observe(timing.time_to_first_token, model=model)
+        load_seconds.observe(timing.load_time, model=model)
+        prompt_tokens.inc(timing.prompt_tokens, model=model)
+        prompt_eval_seconds.inc(timing.prompt_eval_time, model=model)
+        completion_tokens.inc(timing.completion_tokens, model=model)
+        eval_seconds.inc(timing.eval_time, model=model)
+
+
+def summarize_timings(timings: Iterable[Tuple[int, CallTiming]], wall_time: float) -> dict:
+    """Per-conversation timing summary from (turn number, timing) pairs"""
+    turns = []
+    models: Dict[str, dict] = {}
+    for turn, timing in timings:
+        turns.append(dict(timing.as_dict(), turn=turn))
+        stats = models.setdefault(timing.model, {
+            "turns": 0, "generation_s": 0.0, "time_to_first_token_s": 0.0,
+            "completion_tokens": 0, "eval_s": 0.0, "load_s": 0.0,
+        })
+        stats["turns"] += 1
+        stats["generation_s"] += timing.generation_time
+        stats["time_to_first_token_s"] += timing.time_to_first_token or 0.0
+        stats["completion_tokens"] += timing.completion_tokens
+        stats["eval_s"] += timing.eval_time
+        stats["load_s"] += timing.load_time
+    for stats in models.values():
+        stats["avg_time_to_first_token_s"] = round(stats.pop("time_to_first_token_s") / stats["turns"], 4)
+        eval_time = stats.pop("eval_s")
+        stats["eval_tokens_per_s"] = round(stats["completion_tokens"] / eval_time, 2) if eval_time else None
+        stats["generation_s"] = round(stats["generation_s"], 4)
+        stats["load_s"] = round(stats["load_s"], 4)
+    return {"wall_s": round(wall_time, 4), "models": models, "turns": turns}
@@ -0,0 +1,140 @@
+"""
+Cached catalogue of installed Ollama models
+The model list is fetched once, kept in a dict index for O(1) name lookups and refreshed in the
+background, so serving /api/models or validating a new conversation never waits on Ollama.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_INTERVAL = float(os.getenv("AITALK_MODELS_REFRESH", "30"))
+
+NO_MODELS_ERROR = "No models found. Please install models with 'ollama pull model-name'"
+
+
+def normalize_models(models_response) -> List[dict]:
+    """Turn any shape of Ollama's list response into sorted {name, size, modified_at} dicts"""
+    if not models_response:
+        return []
+    # Handle Pydantic response objects as well as plain dicts
+    if hasattr(models_response, 'models'):
+        models_array = models_response.models
+    elif isinstance(models_response, dict) and 'models' in models_response:
+        models_array = models_response['models']
+    else:
+        return []
+
+    model_list = []
+    for model in models_array:
+        if isinstance(model, str):
+            model_list.append({"name": model, "size": 0, "modified_at": ""})
+            continue
+        if isinstance(model, dict):
+            get = model.get
+        elif hasattr(model, 'model'):
+            get = lambda key, default=None, model=model: getattr(model, key, default)  # noqa: E731
+        else:
+            continue
+        name = get('model') or get('name') or get('id')
+        if not name:
+            continue
+        modified_at = get('modified_at', '')
+        model_list.append({
+            "name": name,
+            "size": get('size', 0) or 0,
+            "modified_at": str(modified_at) if modified_at else '',
+        })
+
+    model_list.sort(key=lambda x: x['name'])
+    return model_list
+
+
+def describe_error(error: Exception) -> str:
+    """User-facing message for a failure to list models"""
+    error_msg = str(error)
+    if "connect" in error_msg.lower() or "refused" in error_msg.lower():
+        return "Cannot connect to Ollama service. Please start Ollama with 'ollama serve'"
+    return f"Ollama error: {error_msg}"
+
+
+class ModelRegistry:
+    """TTL-cached, background-refreshed index of the models Ollama has installed"""
+
+    def __init__(self, client, refresh_interval: float = DEFAULT_REFRESH_INTERVAL):
+        self.client = client
+        self.refresh_interval = refresh_interval
+        self.models: Dict[str, dict] = {}
+        self.error: Optional[str] = None
+        self.etag: Optional[str] = None
+        self.updated_at = 0.0
+        self._payload: dict = {"models": [], "error": NO_MODELS_ERROR}
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._background: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the model list has been fetched successfully at least once"""
+        return self.updated_at > 0 and self.error is None
+
+    @property
+    def stale(self) -> bool:
+        return time.time() - self.updated_at > self.refresh_interval
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.models
+
+    async def refresh(self):
+        """Fetch the model list from Ollama and rebuild the index"""
+        async with self._refresh_lock:
+            try:
+                model_list = normalize_models(await self.client.list_models())
+                self.models = {model["name"]: model for model in model_list}
+                self.error = None if model_list else NO_MODELS_ERROR
+            except Exception as e:
+                logger.error(f"Error getting models: {e}")
+                self.error = describe_error(e)
+            self.updated_at = time.time()
+
+            if self.error:
+                payload = {"models": [], "error": self.error}
+            else:
+                payload = {"models": list(self.models), "model_details": list(self.models.values())}
+            self._payload = payload
+            self.etag = '"' + hashlib.sha1(json.dumps(payload, sort_keys=True).encode()).hexdigest() + '"'
+
+    def refresh_soon(self):
+        """Start a background refresh unless one is already running"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def payload(self) -> dict:
+        """The /api/models response; only the very first call waits for Ollama"""
+        if self.updated_at == 0:
+            await self.refresh()
+        elif self.stale:
+            self.refresh_soon()
+        return self._payload
+
+    async def _refresh_forever(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        """Keep the catalogue fresh in the background"""
+        if self._background is None:
+            self._background = asyncio.create_task(self._refresh_forever())
+
+    async def stop(self):
+        for task in (self._background, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+        self._background = None
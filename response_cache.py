@@ -0,0 +1,161 @@
+"""
+Content-addressed cache of model replies
+Replies are keyed on the model, the messages sent and the sampling options, so the same prompt
+is only ever generated once. With a fixed seed or temperature 0 this makes repeated demos and
+regression runs near-instant. The cache is opt-in:
+
+    AITALK_RESPONSE_CACHE=memory                   (in-process LRU)
+    AITALK_RESPONSE_CACHE=sqlite:///responses.db   (LRU in front of an on-disk tier shared between processes)
+
+With default sampling a cached conversation replays exactly, instead of varying from run to run.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import metrics
+
+DEFAULT_MAX_ENTRIES = int(os.getenv("AITALK_RESPONSE_CACHE_MAX_ENTRIES", "512"))
+DEFAULT_MAX_BYTES = int(os.getenv("AITALK_RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Parameters that change how a model is scheduled but not what it replies
+IGNORED_PARAMS = ("keep_alive", "stream")
+
+# Fields of a final Ollama response kept in the cache; durations are dropped so that
+# replayed replies do not skew throughput metrics
+CACHED_FIELDS = ("model", "done_reason", "prompt_eval_count", "eval_count")
+
+
+def cache_key(model: str, messages: List[dict], **params) -> str:
+    """Hash of everything that determines a model's reply"""
+    params = {k: v for k, v in params.items() if v is not None and k not in IGNORED_PARAMS}
+    history = [[message['role'], message['content']] for message in messages]
+    data = json.dumps([model, history, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def cacheable_response(response, content: Optional[str] = None) -> dict:
+    """Plain-dict copy of a final chat response; `content` replaces the text of a streamed reply"""
+    entry = {field: response.get(field) for field in CACHED_FIELDS}
+    entry['message'] = {'role': 'assistant',
+                        'content': content if content is not None else response['message']['content']}
+    entry['done'] = True
+    return entry
+
+
+class ResponseCache:
+    """LRU of recent replies, optionally backed by SQLite with size-based eviction
+
+    Methods are synchronous and thread-safe; async callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    data TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access)")
+
+    def get(self, key: str) -> Optional[dict]:
+        """Return the cached reply for a key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            elif self._db is not None:
+                row = self._db.execute("SELECT data FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    self._db.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+                    entry = json.loads(row[0])
+                    self._remember(key, entry)
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        with metrics.REGISTRY.lock:
+            metrics.response_cache_requests.inc(result="miss" if entry is None else "hit")
+        return entry
+
+    def put(self, key: str, response: dict):
+        """Store a reply made with cacheable_response"""
+        with self._lock:
+            self._remember(key, response)
+            if self._db is not None:
+                data = json.dumps(response, ensure_ascii=False)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, data, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, data, len(data), time.time()))
+                self._evict()
+
+    def _remember(self, key: str, response: dict):
+        self._entries[key] = response
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _evict(self):
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+            if self._db is not None:
+                count, total = self._db.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+                stats.update(disk_entries=count, disk_bytes=total, disk_evictions=self.evictions)
+            return stats
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def create_response_cache(url: Optional[str] = None, **limits) -> Optional[ResponseCache]:
+    """Create the cache configured by AITALK_RESPONSE_CACHE, or None if caching is off"""
+    url = url if url is not None else os.getenv("AITALK_RESPONSE_CACHE", "")
+    if not url or url in ("0", "off"):
+        return None
+    if url == "memory":
+        return ResponseCache(**limits)
+    if url.startswith("sqlite:///"):
+        return ResponseCache(url[len("sqlite:///"):], **limits)
+    raise ValueError(f"Unsupported response cache: {url}")
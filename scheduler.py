@@ -0,0 +1,259 @@
+"""
+Admission control and fair scheduling of model turns
+Every model call of a conversation waits for a slot under a global and a per-model cap. Waiting
+calls are served round-robin across conversations, so a long dialogue cannot starve short ones,
+and calls for the same model can be grouped to cut model swaps. The wait queue is bounded at
+admission: each conversation reserves as many queue places as it can have calls in flight, and
+new conversations are refused once too many are running or the places are taken, so calls of an
+admitted conversation are never refused.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Callable, Deque, Dict, List, Optional
+
+import metrics
+from inference import parse_model_limits
+
+logger = logging.getLogger(__name__)
+
+# Defaults can be overridden through the environment, e.g.
+#   AITALK_MAX_ACTIVE_TURNS=8
+#   AITALK_TURN_MODEL_LIMITS="qwen2:1.5b=4,llama3.2:1b=2"
+#   AITALK_MAX_CONVERSATIONS=32
+#   AITALK_MAX_QUEUED_TURNS=64
+#   AITALK_SCHEDULER_BATCH=4  (for hosts that cannot keep every model loaded)
+#   AITALK_BUSY_RETRY_AFTER=5
+DEFAULT_MAX_ACTIVE = int(os.getenv("AITALK_MAX_ACTIVE_TURNS", "8"))
+DEFAULT_MAX_CONVERSATIONS = int(os.getenv("AITALK_MAX_CONVERSATIONS", "32"))
+DEFAULT_MAX_QUEUED = int(os.getenv("AITALK_MAX_QUEUED_TURNS", "64"))
+# Consecutive slots given to the model that ran last before strict round-robin resumes; 0 lets
+# different models run side by side
+DEFAULT_BATCH = int(os.getenv("AITALK_SCHEDULER_BATCH", "0"))
+# Seconds a refused client is asked to wait before trying again
+BUSY_RETRY_AFTER = int(os.getenv("AITALK_BUSY_RETRY_AFTER", "5"))
+
+# Called with (queue position, model) whenever a waiting call's position changes
+PositionCallback = Callable[[int, str], None]
+
+
+class SchedulerFull(Exception):
+    """Raised when a new conversation cannot be admitted, or an optional call finds no free slot"""
+
+
+class _Waiter:
+    __slots__ = ("key", "model", "future", "on_wait", "position")
+
+    def __init__(self, key: str, model: str, future: asyncio.Future, on_wait: Optional[PositionCallback]):
+        self.key = key
+        self.model = model
+        self.future = future
+        self.on_wait = on_wait
+        self.position = 0
+
+
+class TurnScheduler:
+    """Grants model-call slots fairly across conversations"""
+
+    def __init__(self, max_active: int = DEFAULT_MAX_ACTIVE, model_limits: Optional[Dict[str, int]] = None,
+                 max_conversations: int = DEFAULT_MAX_CONVERSATIONS, max_queued: int = DEFAULT_MAX_QUEUED,
+                 batch: int = DEFAULT_BATCH):
+        self.max_active = max_active
+        self.model_limits = dict(model_limits if model_limits is not None
+                                 else parse_model_limits(os.getenv("AITALK_TURN_MODEL_LIMITS")))
+        self.max_conversations = max_conversations
+        self.max_queued = max_queued
+        self.batch = batch
+        self.active = 0
+        self.active_by_model: Dict[str, int] = {}
+        self.conversations = 0
+        # Queue places reserved by the running conversations; waiting never exceeds it
+        self.reserved = 0
+        self.waiting = 0
+        # Per-conversation FIFO of waiting calls; the dict order is the round-robin order
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._last_model: Optional[str] = None
+        self._streak = 0
+
+    @property
+    def saturated(self) -> bool:
+        return self.conversations >= self.max_conversations or self.reserved >= self.max_queued
+
+    def _places(self, places: int) -> int:
+        # A conversation larger than the whole queue still runs, alone
+        return max(1, min(places, self.max_queued))
+
+    def open_conversation(self, places: int = 1):
+        """Admit a new conversation that can have up to `places` model calls in flight, or raise SchedulerFull"""
+        places = self._places(places)
+        if self.conversations >= self.max_conversations or self.reserved + places > self.max_queued:
+            raise SchedulerFull(f"Server busy: {self.conversations} conversations running, "
+                                f"{self.reserved} of {self.max_queued} queue places taken")
+        self.conversations += 1
+        self.reserved += places
+
+    def close_conversation(self, places: int = 1):
+        self.conversations -= 1
+        self.reserved -= self._places(places)
+
+    def _can_run(self, model: str) -> bool:
+        limit = self.model_limits.get(model, self.max_active)
+        return self.active < self.max_active and self.active_by_model.get(model, 0) < limit
+
+    @asynccontextmanager
+    async def slot(self, key: str, model: str, on_wait: Optional[PositionCallback] = None,
+                   optional: bool = False):
+        """Hold a slot for one model call of conversation `key`
+
+        An optional call never queues: it raises SchedulerFull unless it can start right away, so
+        it cannot take a queue place reserved for the conversations' replies.
+        """
+        if optional and (self.waiting or not self._can_run(model)):
+            raise SchedulerFull(f"No free slot for {model}")
+        queued = time.perf_counter()
+        waiter = _Waiter(key, model, asyncio.get_running_loop().create_future(), on_wait)
+        self._queues.setdefault(key, deque()).append(waiter)
+        self.waiting += 1
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller was cancelled
+                self._release(model)
+            else:
+                self._remove(waiter)
+            raise
+        with metrics.REGISTRY.lock:
+            metrics.scheduler_wait_seconds.observe(time.perf_counter() - queued, model=model)
+        try:
+            yield
+        finally:
+            self._release(model)
+
+    def _remove(self, waiter: _Waiter):
+        queue = self._queues.get(waiter.key)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue:
+                del self._queues[waiter.key]
+            self._dispatch()
+
+    def _release(self, model: str):
+        self.active -= 1
+        self.active_by_model[model] -= 1
+        self._dispatch()
+
+    def _next(self) -> Optional[_Waiter]:
+        """The head of the first conversation in round-robin order whose model has room
+
+        With batching, the model that ran last keeps the slots for up to `batch` consecutive
+        calls while other models are waiting. The next model then starts once the running calls
+        have finished, so the host swaps models once per batch instead of thrashing.
+        """
+        first = same = other = None
+        for queue in self._queues.values():
+            waiter = queue[0]
+            if not self._can_run(waiter.model):
+                continue
+            first = first or waiter
+            if waiter.model == self._last_model:
+                same = same or waiter
+            else:
+                other = other or waiter
+        if not self.batch or first is None:
+            return first
+        if other is None:
+            # Nobody is kept waiting, so the batch starts over
+            self._streak = 0
+            return same
+        if same is not None and self._streak < self.batch:
+            return same
+        if self.active_by_model.get(self._last_model):
+            return None
+        return other
+
+    def _dispatch(self):
+        while self.waiting:
+            waiter = self._next()
+            if waiter is None:
+                break
+            queue = self._queues[waiter.key]
+            queue.popleft()
+            self.waiting -= 1
+            if queue:
+                # This conversation goes to the back of the round-robin order
+                self._queues.move_to_end(waiter.key)
+            else:
+                del self._queues[waiter.key]
+            if waiter.future.done():
+                continue  # cancelled while queued
+            self.active += 1
+            self.active_by_model[waiter.model] = self.active_by_model.get(waiter.model, 0) + 1
+            if waiter.model == self._last_model:
+                self._streak += 1
+            else:
+                self._last_model, self._streak = waiter.model, 1
+            waiter.future.set_result(None)
+        self._notify_positions()
+
+    def _notify_positions(self):
+        position = 0
+        for queue in self._queues.values():
+            for waiter in queue:
+                position += 1
+                if waiter.position != position and waiter.on_wait is not None:
+                    waiter.position = position
+                    try:
+                        waiter.on_wait(position, waiter.model)
+                    except Exception as e:
+                        logger.error(f"Error reporting queue position: {e}")
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "active": self.active,
+            "waiting": self.waiting,
+            "reserved": self.reserved,
+            "conversations": self.conversations,
+        }
+
+
+class ScheduledClient:
+    """InferenceClient wrapper that runs one conversation's model calls through a TurnScheduler"""
+
+    def __init__(self, client, scheduler: TurnScheduler, key: str, on_wait: Optional[PositionCallback] = None):
+        self.client = client
+        self.scheduler = scheduler
+        self.key = key
+        self.on_wait = on_wait
+
+    async def chat(self, model: str, messages: List[dict], **kwargs):
+        # A cached reply needs no slot, so hits never wait behind generations
+        cached = await self.client.cached(model, messages, **kwargs)
+        if cached is not None:
+            return cached
+        async with self.scheduler.slot(self.key, model, self.on_wait):
+            return await self.client.chat(model, messages, lookup=False, **kwargs)
+
+    async def chat_stream(self, model: str, messages: List[dict], **kwargs):
+        cached = await self.client.cached(model, messages, **kwargs)
+        if cached is not None:
+            yield cached
+            return
+        async with self.scheduler.slot(self.key, model, self.on_wait):
+            async for part in self.client.chat_stream(model, messages, lookup=False, **kwargs):
+                yield part
+
+    async def preload(self, model: str, **kwargs):
+        # Loading ahead is optional; when it would have to wait the model loads on its first turn instead
+        try:
+            async with self.scheduler.slot(self.key, model, optional=True):
+                return await self.client.preload(model, **kwargs)
+        except SchedulerFull as e:
+            logger.info(f"Skipping preload of {model}: {e}")
+            return None
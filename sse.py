@@ -0,0 +1,134 @@
+"""
+Event encoding for conversation streams
+Events are JSON objects with a "type" field, encoded with a pre-built prefix per type. Message
+text travels in compact chunk frames that hold only a JSON string; the text generated during one
+flush interval is coalesced into a single frame.
+
+Every event gets a sequential id and is kept in a bounded per-conversation EventLog, so clients
+can reconnect with Last-Event-ID and several viewers can follow the same conversation.
+
+    sse     text/event-stream for EventSource: "data: {...}" events, "event: chunk" text frames
+    ndjson  application/x-ndjson for other consumers: one JSON value per line, strings are chunks
+"""
+
+import asyncio
+import itertools
+import json
+import os
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+# Text generated within this many milliseconds is sent as one chunk frame
+FLUSH_INTERVAL = float(os.getenv("AITALK_SSE_FLUSH_MS", "50")) / 1000
+# Events kept per conversation for clients that reconnect
+REPLAY_BUFFER = int(os.getenv("AITALK_STREAM_BUFFER", "2048"))
+
+MEDIA_TYPES = {"sse": "text/event-stream", "ndjson": "application/x-ndjson"}
+
+_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+_prefixes: Dict[str, str] = {}
+
+
+def encode_event(event_type: str, **fields) -> str:
+    """JSON text of an event; field names must be plain identifiers"""
+    prefix = _prefixes.get(event_type)
+    if prefix is None:
+        prefix = _prefixes[event_type] = '{"type":' + _encode(event_type)
+    parts = [prefix]
+    for key, value in fields.items():
+        parts.append(f',"{key}":{_encode(value)}')
+    parts.append('}')
+    return ''.join(parts)
+
+
+def encode_chunk(content: str) -> str:
+    """JSON text of a chunk of the current message"""
+    return _encode(content)
+
+
+class EventEncoder:
+    """Frames encoded events for one response format"""
+
+    def __init__(self, format: str = "sse"):
+        if format not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported stream format: {format}")
+        self.format = format
+        self.media_type = MEDIA_TYPES[format]
+
+    def frame(self, data: str, chunk: bool = False, event_id: Optional[int] = None) -> str:
+        if self.format == "ndjson":
+            # Lines are numbered implicitly: the Nth line of a stream is event (last id + N)
+            return data + "\n"
+        head = f"id: {event_id}\n" if event_id is not None else ""
+        return head + ("event: chunk\ndata: " if chunk else "data: ") + data + "\n\n"
+
+    def event(self, event_type: str, **fields) -> str:
+        return self.frame(encode_event(event_type, **fields))
+
+    def chunk(self, content: str) -> str:
+        return self.frame(encode_chunk(content), chunk=True)
+
+
+# (id, JSON text, whether it is a chunk frame)
+Event = Tuple[int, str, bool]
+
+
+class EventLog:
+    """Ring buffer of a conversation's encoded events, shared by everyone watching it
+
+    Events are numbered from 1. Subscribers replay what they missed and then follow new events
+    until the log is closed; when the buffer has wrapped, replay starts at the oldest event kept.
+    """
+
+    def __init__(self, size: int = REPLAY_BUFFER):
+        self.last_id = 0
+        self.closed = False
+        self.subscribers = 0
+        # Managed by the owner: the task producing the events and a pending idle check
+        self.task: Optional[asyncio.Task] = None
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+        self._events: Deque[Event] = deque(maxlen=size)
+        self._changed = asyncio.Event()
+
+    def publish(self, data: str, chunk: bool = False):
+        self.last_id += 1
+        self._events.append((self.last_id, data, chunk))
+        self._notify()
+
+    def event(self, event_type: str, **fields):
+        self.publish(encode_event(event_type, **fields))
+
+    def chunk(self, content: str):
+        self.publish(encode_chunk(content), chunk=True)
+
+    def close(self):
+        self.closed = True
+        self._notify()
+
+    def _notify(self):
+        # Wakes every waiting subscriber; they re-check the buffer themselves
+        self._changed.set()
+        self._changed.clear()
+
+    def _after(self, event_id: int):
+        if not self._events or event_id >= self.last_id:
+            return []
+        start = max(0, event_id + 1 - self._events[0][0])
+        return list(itertools.islice(self._events, start, None))
+
+    async def subscribe(self, after: int = 0):
+        """Yield the events after the given id, then live ones until the log is closed"""
+        self.subscribers += 1
+        try:
+            while True:
+                pending = self._after(after)
+                if pending:
+                    for event in pending:
+                        yield event
+                    after = pending[-1][0]
+                    continue
+                if self.closed:
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
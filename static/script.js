@@ -8,6 +8,8 @@ class AiTalkDual {
         this.currentMessages = [];
         this.currentTurn = 0;
         this.totalTurns = 4;
+        this.eventQueue = [];
+        this.isRendering = false;
 
         this.initializeElements();
         this.setupEventListeners();
@@ -23,6 +25,7 @@ class AiTalkDual {
         this.turnsInput = document.getElementById('turns');
         this.typingSpeedInput = document.getElementById('typingSpeed');
         this.speedValueSpan = document.getElementById('speedValue');
+        this.typewriterCheckbox = document.getElementById('typewriter');
 
         // Control elements
         this.startBtn = document.getElementById('startBtn');
@@ -218,7 +221,8 @@ class AiTalkDual {
                 model1_context: this.model1ContextTextarea.value.trim(),
                 model2_context: this.model2ContextTextarea.value.trim(),
                 turns: parseInt(this.turnsInput.value),
-                typing_speed: parseFloat(this.typingSpeedInput.value)
+                typing_speed: parseFloat(this.typingSpeedInput.value),
+                stream_tokens: true
             };
 
             this.totalTurns = config.turns;
@@ -233,6 +237,10 @@ class AiTalkDual {
                 body: JSON.stringify(config)
             });
 
+            if (response.status === 429) {
+                const retryAfter = response.headers.get('Retry-After');
+                throw new Error(`Server busy, please try again${retryAfter ? ` in ${retryAfter}s` : ' shortly'}`);
+            }
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -264,10 +272,25 @@ class AiTalkDual {
             console.log('EventSource connection opened');
         };
 
+        // Message text arrives in compact "chunk" frames holding only a JSON string
+        this.eventSource.addEventListener('chunk', (event) => {
+            try {
+                this.enqueueStreamEvent({ type: 'message_chunk', content: JSON.parse(event.data) });
+            } catch (error) {
+                console.error('Error parsing stream chunk:', error);
+            }
+        });
+
         this.eventSource.onmessage = (event) => {
             try {
                 const data = JSON.parse(event.data);
-                this.handleStreamEvent(data);
+                if (['complete', 'error', 'cancelled'].includes(data.type) && this.eventSource) {
+                    // Close right away so the browser does not reconnect while typing catches up.
+                    // Dropped connections are left to EventSource, which resumes via Last-Event-ID.
+                    this.eventSource.close();
+                    this.eventSource = null;
+                }
+                this.enqueueStreamEvent(data);
             } catch (error) {
                 console.error('Error parsing stream data:', error);
             }
@@ -297,6 +320,39 @@ class AiTalkDual {
         };
     }
 
+    enqueueStreamEvent(data) {
+        // Events are rendered in order; chunks may be paced by the typewriter effect
+        this.eventQueue.push(data);
+        if (!this.isRendering) {
+            this.renderQueuedEvents();
+        }
+    }
+
+    async renderQueuedEvents() {
+        this.isRendering = true;
+        while (this.eventQueue.length > 0) {
+            const data = this.eventQueue.shift();
+            if (data.type === 'message_chunk' && this.typewriterCheckbox && this.typewriterCheckbox.checked) {
+                await this.typeOut(data.content);
+            } else {
+                this.handleStreamEvent(data);
+            }
+        }
+        this.isRendering = false;
+    }
+
+    async typeOut(content) {
+        // Client-side throttle: reveal streamed text at the configured chars/sec
+        const speed = Math.max(1, parseFloat(this.typingSpeedInput.value) || 50);
+        const tickMs = 50;
+        const charsPerTick = Math.max(1, Math.round(speed * tickMs / 1000));
+        for (let i = 0; i < content.length; i += charsPerTick) {
+            if (!this.isRunning) return;
+            this.appendToCurrentMessage(content.slice(i, i + charsPerTick));
+            await new Promise(resolve => setTimeout(resolve, charsPerTick * 1000 / speed));
+        }
+    }
+
     handleStreamEvent(data) {
         switch (data.type) {
             case 'start':
@@ -313,11 +369,21 @@ class AiTalkDual {
                 break;
 
             case 'thinking':
-                this.showThinking(data.model, data.turn);
+                this.showThinking(data.name || data.model, data.turn);
+                break;
+
+            case 'queued':
+                // The server is busy; the next reply waits for a free slot
+                this.updateStatus(`Waiting for ${data.model} (position ${data.position} in queue)...`, 'active');
+                this.waitingInQueue = true;
                 break;
 
             case 'message_start':
-                this.startMessage(data.model, data.turn);
+                if (this.waitingInQueue) {
+                    this.waitingInQueue = false;
+                    this.updateStatus('Conversation in progress', 'active');
+                }
+                this.startMessage(data.model, data.turn, data.cached, data.name, data.speaker);
                 break;
 
             case 'message_chunk':
@@ -341,6 +407,13 @@ class AiTalkDual {
                 }
                 break;
 
+            case 'cancelled':
+                this.updateStatus(data.message);
+                this.hideProgress();
+                this.isRunning = false;
+                this.updateControlButtons();
+                break;
+
             case 'error':
                 this.showError(data.message);
                 this.isRunning = false;
@@ -376,23 +449,25 @@ class AiTalkDual {
         }
     }
 
-    startMessage(model, turn) {
+    startMessage(model, turn, cached = false, name = null, speaker = null) {
         this.removeThinking();
         this.currentTurn = turn;
         
+        // With more than two participants, speakers alternate sides in speaking order
+        const isModel1 = speaker != null ? speaker % 2 === 0 : model === this.model1Select.value;
         const messageDiv = document.createElement('div');
-        messageDiv.className = `message ${model === this.model1Select.value ? 'model1' : 'model2'}`;
+        messageDiv.className = `message ${isModel1 ? 'model1' : 'model2'}`;
         messageDiv.id = 'current-message';
         
-        const isModel1 = model === this.model1Select.value;
         const avatarClass = isModel1 ? 'model1' : 'model2';
         const avatarIcon = isModel1 ? '🤖' : '🤖';
         
         messageDiv.innerHTML = `
             <div class="message-header">
                 <div class="model-avatar ${avatarClass}">${avatarIcon}</div>
-                <span class="model-name">${model}</span>
+                <span class="model-name" title="${model}">${name || model}</span>
                 <span class="turn-info">Turn ${turn}</span>
+                ${cached ? '<span class="turn-info" title="Served from the response cache">cached</span>' : ''}
             </div>
             <div class="message-content" id="current-content"></div>
         `;
@@ -440,6 +515,7 @@ class AiTalkDual {
     async stopConversation() {
         // Mark as not running first to prevent error messages
         this.isRunning = false;
+        this.eventQueue.length = 0;
         
         if (this.eventSource) {
             this.eventSource.close();
@@ -0,0 +1,135 @@
+"""
+Admission control of the turn scheduler: conversations reserve their queue places when admitted,
+so the calls of an admitted conversation are never refused, preloads included.
+
+    python -m pytest tests
+"""
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from conversation import Conversation, Participant, RoundRobin  # noqa: E402
+from scheduler import ScheduledClient, SchedulerFull, TurnScheduler  # noqa: E402
+
+MODELS = ["qwen2:1.5b", "llama3.2:1b", "phi3:mini", "gemma2:2b"]
+
+
+class FakeClient:
+    """Replies after a short delay, like a model that is already loaded"""
+
+    def __init__(self):
+        self.preloads = 0
+
+    async def cached(self, model, messages, **kwargs):
+        return None
+
+    async def chat_stream(self, model, messages, **kwargs):
+        await asyncio.sleep(0.005)
+        yield {'message': {'role': 'assistant', 'content': f"Hello from {model}"}, 'done': False}
+        yield {'message': {'role': 'assistant', 'content': ''}, 'done': True}
+
+    async def preload(self, model, **kwargs):
+        self.preloads += 1
+        await asyncio.sleep(0.005)
+
+
+async def run_conversations(scheduler, count, participants=4, turns=2):
+    """Admit up to `count` conversations and run the admitted ones to the end"""
+    client = FakeClient()
+    waiting = []
+    admitted, refused = [], 0
+    for n in range(count):
+        try:
+            scheduler.open_conversation(participants)
+        except SchedulerFull:
+            refused += 1
+            continue
+        scheduled = ScheduledClient(client, scheduler, f"conversation-{n}",
+                                    on_wait=lambda position, model: waiting.append(scheduler.waiting))
+        speakers = [Participant(f"Speaker {i}", MODELS[i % len(MODELS)], "You are chatting.")
+                    for i in range(participants)]
+        admitted.append(Conversation(scheduled, speakers, RoundRobin(turns * participants), preload=True))
+
+    async def run(dialogue):
+        try:
+            return [turn async for turn in dialogue]
+        finally:
+            dialogue.cancel()
+            scheduler.close_conversation(participants)
+
+    for dialogue in admitted:
+        dialogue.start()
+    results = await asyncio.gather(*(run(dialogue) for dialogue in admitted))
+    return results, refused, waiting
+
+
+def test_admitted_conversations_are_never_refused():
+    # Four conversations of four participants each reserve 16 places, more than the queue holds
+    scheduler = TurnScheduler(max_active=2, model_limits={}, max_conversations=4, max_queued=8)
+    results, refused, waiting = asyncio.run(run_conversations(scheduler, 4))
+
+    assert refused == 2
+    assert len(results) == 2
+    for turns in results:
+        assert len(turns) == 8
+        assert all(turn.content and turn.content.startswith("Hello from") for turn in turns)
+    assert max(waiting, default=0) <= 8
+    assert scheduler.stats() == {"active": 0, "waiting": 0, "reserved": 0, "conversations": 0}
+
+
+def test_queue_stays_within_the_reserved_places():
+    scheduler = TurnScheduler(max_active=2, model_limits={}, max_conversations=4, max_queued=16)
+    results, refused, waiting = asyncio.run(run_conversations(scheduler, 4))
+
+    assert refused == 0
+    assert [len(turns) for turns in results] == [8, 8, 8, 8]
+    assert max(waiting) <= 16
+    assert scheduler.reserved == 0
+
+
+def test_preload_does_not_queue():
+    scheduler = TurnScheduler(max_active=1, model_limits={}, max_queued=4)
+
+    async def scenario():
+        client = ScheduledClient(FakeClient(), scheduler, "conversation")
+        async with scheduler.slot("other", MODELS[0]):
+            # Every slot is taken, so the preload is skipped instead of waiting in the queue
+            assert await client.preload(MODELS[1]) is None
+            assert scheduler.waiting == 0
+        await client.preload(MODELS[1])
+        assert client.client.preloads == 1
+
+    asyncio.run(scenario())
+
+
+def test_oversized_conversation_runs_alone():
+    scheduler = TurnScheduler(max_active=2, model_limits={}, max_queued=4)
+    scheduler.open_conversation(6)
+    with pytest.raises(SchedulerFull):
+        scheduler.open_conversation(1)
+    scheduler.close_conversation(6)
+    assert scheduler.reserved == 0
+
+
+def test_cache_hit_skips_the_queue():
+    scheduler = TurnScheduler(max_active=1, model_limits={}, max_queued=4)
+
+    class CachedClient(FakeClient):
+        async def cached(self, model, messages, **kwargs):
+            return {'message': {'role': 'assistant', 'content': "Cached"}, 'done': True}
+
+    async def scenario():
+        client = ScheduledClient(CachedClient(), scheduler, "conversation")
+        async with scheduler.slot("other", MODELS[0]):
+            # Served while every slot is taken
+            parts = [part async for part in client.chat_stream(MODELS[0], [])]
+            assert await client.chat(MODELS[0], []) == parts[0]
+            assert scheduler.waiting == 0
+
+    asyncio.run(asyncio.wait_for(scenario(), timeout=5))
@@ -0,0 +1,379 @@
+"""
+Archive of finished and running conversations
+Every turn is appended to a segmented, append-only log on disk as it happens. A background thread
+writes buffered records and fsyncs them every AITALK_ARCHIVE_FSYNC_INTERVAL seconds, then indexes
+them in SQLite (with full-text search) in the same batch. Exports read the log back with
+generators, so a transcript is never loaded into memory as a whole. The archive is opt-in:
+
+    AITALK_ARCHIVE=transcripts    (directory holding the log segments and archive.db)
+
+Each process writes its own segments, so several uvicorn workers can share one directory. The
+log is the source of truth: records that were fsynced but not yet indexed when a process died
+are indexed the next time the archive is opened.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FSYNC_INTERVAL = float(os.getenv("AITALK_ARCHIVE_FSYNC_INTERVAL", "1.0"))
+DEFAULT_SEGMENT_BYTES = int(os.getenv("AITALK_ARCHIVE_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+
+SEGMENT_SUFFIX = ".jsonl"
+READ_CHUNK = 256 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    started REAL NOT NULL,
+    ended REAL,
+    status TEXT NOT NULL DEFAULT 'running',
+    participants TEXT NOT NULL,
+    config TEXT NOT NULL,
+    turns INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY,
+    conversation_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    model TEXT NOT NULL,
+    content TEXT NOT NULL,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    UNIQUE (conversation_id, idx)
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(
+    content, name, content='turns', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS turns_indexed AFTER INSERT ON turns BEGIN
+    INSERT INTO turns_fts (rowid, content, name) VALUES (new.id, new.content, new.name);
+END;
+CREATE TABLE IF NOT EXISTS segments (
+    name TEXT PRIMARY KEY,
+    indexed_bytes INTEGER NOT NULL
+);
+"""
+
+
+def fts_query(text: str) -> str:
+    """Turn free text into an FTS5 query matching every word, so user input is never parsed as syntax"""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+
+class TranscriptArchive:
+    """Append-only transcript log with a SQLite index
+
+    Appending only buffers the record, so it is safe to call from the event loop. Reads and
+    flush() block and are thread-safe; async callers run them with asyncio.to_thread.
+    """
+
+    def __init__(self, directory: str, fsync_interval: float = DEFAULT_FSYNC_INTERVAL,
+                 segment_bytes: int = DEFAULT_SEGMENT_BYTES):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        self.flushes = 0
+        self.records = 0
+        os.makedirs(directory, exist_ok=True)
+        self._db_path = os.path.join(directory, "archive.db")
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending: List[dict] = []
+        # (segment, located records, end offset) of batches written to the log but not indexed yet
+        self._unindexed: List[tuple] = []
+        self._segment = None
+        self._segment_name: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._db = self._connect()
+        self._db.executescript(SCHEMA)
+        self._recover()
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self._db_path, check_same_thread=False, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def start(self):
+        """Flush in the background every fsync_interval seconds"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="transcript-archive", daemon=True)
+            self._thread.start()
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                # Records stay buffered, or written but unindexed, and are retried at the next interval
+                with self._lock:
+                    pending = len(self._pending)
+                logger.error(f"Error flushing transcript archive {self.directory} ({pending} records buffered, "
+                             f"{sum(len(batch[1]) for batch in self._unindexed)} not indexed): {e}")
+
+    # Writing
+
+    def _append(self, record: dict):
+        record["time"] = round(time.time(), 3)
+        with self._lock:
+            self._pending.append(record)
+
+    def start_conversation(self, conversation_id: str, config: dict, participants: List[dict]):
+        """Record a new conversation; participants are dicts with a name and a model"""
+        self._append({"type": "conversation", "conversation_id": conversation_id,
+                      "participants": participants, "config": config})
+
+    def add_turn(self, conversation_id: str, index: int, number: int, speaker: int, name: str, model: str,
+                 content: str, timing: Optional[dict] = None):
+        """Record one reply; `index` counts turns across speakers, `number` is the speaker's own count"""
+        self._append({"type": "turn", "conversation_id": conversation_id, "index": index, "turn": number,
+                      "speaker": speaker, "name": name, "model": model, "content": content,
+                      "timing": timing})
+
+    def end_conversation(self, conversation_id: str, status: str, timing: Optional[dict] = None):
+        """Record how the conversation ended: completed, cancelled or error"""
+        self._append({"type": "end", "conversation_id": conversation_id, "status": status, "timing": timing})
+
+    def flush(self):
+        """Write buffered records to the log, fsync it and index them"""
+        with self._flush_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if not records:
+                # Retry batches whose indexing failed earlier
+                self._index_written()
+                return
+            try:
+                lines = [json.dumps(record, ensure_ascii=False).encode() + b"\n" for record in records]
+                segment, start = self._open_segment()
+                self._segment.write(b"".join(lines))
+                self._segment.flush()
+                os.fsync(self._segment.fileno())
+            except Exception:
+                with self._lock:
+                    self._pending[:0] = records
+                raise
+            located = []
+            offset = start
+            for record, line in zip(records, lines):
+                located.append((record, offset, len(line)))
+                offset += len(line)
+            self.flushes += 1
+            self.records += len(records)
+            self._unindexed.append((segment, located, offset))
+            self._index_written()
+
+    def _index_written(self):
+        """Index written batches in order
+
+        A batch whose transaction fails stays queued and is retried first at the next flush, so a
+        segment's indexed_bytes never moves past records that are missing from the index. Only
+        the flusher uses the writer connection; appends never wait for the index.
+        """
+        while self._unindexed:
+            segment, located, end = self._unindexed[0]
+            self._index(segment, located, end)
+            self._unindexed.pop(0)
+
+    def _open_segment(self):
+        """The current segment and its size, starting a new one once it is full"""
+        if self._segment is not None and self._segment.tell() >= self.segment_bytes:
+            self._segment.close()
+            self._segment = None
+        if self._segment is None:
+            # Named by creation time, so sorting the names orders the whole log
+            self._segment_name = f"{time.time_ns():020d}-{os.getpid()}{SEGMENT_SUFFIX}"
+            self._segment = open(os.path.join(self.directory, self._segment_name), "ab")
+        return self._segment_name, self._segment.tell()
+
+    # Indexing
+
+    def _index(self, segment: str, located, indexed_bytes: int):
+        """Index (record, offset, length) triples of one segment in a single transaction
+
+        Indexing is idempotent, so replaying part of a segment after a crash is harmless.
+        """
+        db = self._db
+        db.execute("BEGIN")
+        try:
+            for record, offset, length in located:
+                kind = record.get("type")
+                if kind == "conversation":
+                    db.execute(
+                        "INSERT OR IGNORE INTO conversations (id, started, participants, config) VALUES (?, ?, ?, ?)",
+                        (record["conversation_id"], record["time"], json.dumps(record["participants"]),
+                         json.dumps(record["config"])))
+                elif kind == "turn":
+                    inserted = db.execute(
+                        "INSERT OR IGNORE INTO turns (conversation_id, idx, name, model, content, segment, offset, length)"
+                        " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (record["conversation_id"], record["index"], record["name"], record["model"],
+                         record["content"], segment, offset, length)).rowcount
+                    if inserted:
+                        tokens = (record.get("timing") or {}).get("completion_tokens") or 0
+                        db.execute("UPDATE conversations SET turns = turns + 1, completion_tokens = completion_tokens + ?"
+                                   " WHERE id = ?", (tokens, record["conversation_id"]))
+                elif kind == "end":
+                    db.execute("UPDATE conversations SET ended = ?, status = ? WHERE id = ?",
+                               (record["time"], record["status"], record["conversation_id"]))
+            db.execute("INSERT INTO segments (name, indexed_bytes) VALUES (?, ?) ON CONFLICT (name) DO UPDATE"
+                       " SET indexed_bytes = MAX(indexed_bytes, excluded.indexed_bytes)", (segment, indexed_bytes))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _recover(self):
+        """Index complete records that reached the log but not the index"""
+        indexed = dict(self._db.execute("SELECT name, indexed_bytes FROM segments"))
+        for segment in self._segments():
+            start = indexed.get(segment, 0)
+            path = os.path.join(self.directory, segment)
+            if os.path.getsize(path) <= start:
+                continue
+            located = []
+            offset = start
+            with open(path, "rb") as f:
+                f.seek(start)
+                for line in f:
+                    # A partial last line is still being written by another process
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        located.append((json.loads(line), offset, len(line)))
+                    except ValueError:
+                        logger.warning(f"Skipping unreadable record at {segment}:{offset}")
+                    offset += len(line)
+            if offset > start:
+                self._index(segment, located, offset)
+
+    def _segments(self) -> List[str]:
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+
+    # Reading
+
+    def _query(self, sql: str, args=()) -> List[tuple]:
+        db = self._connect()
+        try:
+            return db.execute(sql, args).fetchall()
+        finally:
+            db.close()
+
+    @staticmethod
+    def _summary(row) -> dict:
+        seq, conversation_id, started, ended, status, participants, turns, tokens = row
+        return {"conversation_id": conversation_id, "seq": seq, "started": started, "ended": ended,
+                "status": status, "participants": json.loads(participants), "turns": turns,
+                "completion_tokens": tokens}
+
+    def list_conversations(self, before: Optional[int] = None, limit: int = 50) -> List[dict]:
+        """Newest conversations first; pass the last `seq` as `before` for the next page
+
+        Pages are found through the primary key, so deep pages cost the same as the first one.
+        """
+        rows = self._query(
+            "SELECT seq, id, started, ended, status, participants, turns, completion_tokens FROM conversations"
+            " WHERE seq < ? ORDER BY seq DESC LIMIT ?", (before if before is not None else 2**63 - 1, limit))
+        return [self._summary(row) for row in rows]
+
+    def get_conversation(self, conversation_id: str) -> Optional[dict]:
+        rows = self._query(
+            "SELECT seq, id, started, ended, status, participants, turns, completion_tokens, config"
+            " FROM conversations WHERE id = ?", (conversation_id,))
+        if not rows:
+            return None
+        summary = self._summary(rows[0][:-1])
+        summary["config"] = json.loads(rows[0][-1])
+        return summary
+
+    def search(self, text: str, limit: int = 20) -> List[dict]:
+        """Best matching turns for the words in `text`, with a highlighted snippet"""
+        query = fts_query(text)
+        if not query:
+            return []
+        rows = self._query(
+            "SELECT turns.conversation_id, turns.idx, turns.name, turns.model,"
+            " snippet(turns_fts, 0, '[', ']', '…', 12) FROM turns_fts"
+            " JOIN turns ON turns.id = turns_fts.rowid WHERE turns_fts MATCH ? ORDER BY rank LIMIT ?",
+            (query, limit))
+        return [{"conversation_id": conversation_id, "index": index, "name": name, "model": model,
+                 "snippet": snippet} for conversation_id, index, name, model, snippet in rows]
+
+    def iter_turns(self, conversation_id: str) -> Iterator[bytes]:
+        """The conversation's turn records as JSON lines, read from the log one at a time"""
+        db = self._connect()
+        files: Dict[str, object] = {}
+        try:
+            cursor = db.execute("SELECT segment, offset, length FROM turns WHERE conversation_id = ? ORDER BY idx",
+                                (conversation_id,))
+            for segment, offset, length in cursor:
+                f = files.get(segment)
+                if f is None:
+                    f = files[segment] = open(os.path.join(self.directory, segment), "rb")
+                f.seek(offset)
+                yield f.read(length)
+        finally:
+            for f in files.values():
+                f.close()
+            db.close()
+
+    def iter_log(self) -> Iterator[bytes]:
+        """Every indexed record of every conversation as JSON lines, in the order they were written"""
+        indexed = dict(self._query("SELECT name, indexed_bytes FROM segments"))
+        for segment in self._segments():
+            remaining = indexed.get(segment, 0)
+            with open(os.path.join(self.directory, segment), "rb") as f:
+                while remaining > 0:
+                    chunk = f.read(min(READ_CHUNK, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+
+    def stats(self) -> Dict[str, int]:
+        conversations, turns = self._query(
+            "SELECT COUNT(*), COALESCE(SUM(turns), 0) FROM conversations")[0]
+        segments = self._segments()
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "conversations": conversations,
+            "turns": turns,
+            "segments": len(segments),
+            "log_bytes": sum(os.path.getsize(os.path.join(self.directory, name)) for name in segments),
+            "pending_records": pending,
+            "unindexed_records": sum(len(batch[1]) for batch in self._unindexed),
+            "flushes": self.flushes,
+        }
+
+    def close(self):
+        """Stop the background thread and flush what is still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+        with self._flush_lock:
+            if self._segment is not None:
+                self._segment.close()
+                self._segment = None
+            self._db.close()
+
+
+def create_archive(directory: Optional[str] = None, **options) -> Optional[TranscriptArchive]:
+    """Create the archive configured by AITALK_ARCHIVE, or None if archiving is off"""
+    directory = directory if directory is not None else os.getenv("AITALK_ARCHIVE", "")
+    if not directory or directory in ("0", "off"):
+        return None
+    return TranscriptArchive(directory, **options)
@@ -3,23 +3,73 @@ Improved AiTalkDual Web Interface
 Each AI model gets its own private context and doesn't know it's talking to another AI
 """
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import HTMLResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
-import ollama
-import json
 import asyncio
+import json
+import os
 import uuid
 from typing import Dict, List, Optional
 import logging
 
+from conversation import Conversation, ImprovedConversationConfig, Turn
+from conversation_store import create_store
+from response_cache import create_response_cache
+from transcript_archive import create_archive
+from sse import FLUSH_INTERVAL, MEDIA_TYPES, EventEncoder, EventLog
+import metrics
+from inference import InferenceClient
+from model_registry import ModelRegistry
+from scheduler import BUSY_RETRY_AFTER, ScheduledClient, SchedulerFull, TurnScheduler
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+# Opt-in cache of replies to identical prompts (see AITALK_RESPONSE_CACHE)
+response_cache = create_response_cache()
+
+# Shared non-blocking Ollama client used by every endpoint, routing between AITALK_BACKENDS if set
+inference = InferenceClient(response_cache=response_cache)
+
+# Append-only log of every turn, searchable and exportable (see AITALK_ARCHIVE)
+transcript_archive = create_archive()
 
-app = FastAPI(title="AiTalkDual Improved", description="AI Conversation Simulator - Natural Conversations")
+# Admission control and fair ordering of every conversation's model calls (see AITALK_MAX_ACTIVE_TURNS)
+turn_scheduler = TurnScheduler()
+
+# Installed models, refreshed in the background (see AITALK_MODELS_REFRESH)
+model_registry = ModelRegistry(inference)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    model_registry.start()
+    inference.start()
+    loop_watch = asyncio.create_task(metrics.watch_event_loop())
+    if transcript_archive is not None:
+        transcript_archive.start()
+    yield
+    loop_watch.cancel()
+    await model_registry.stop()
+    # Let running conversations save their final state before the store closes
+    tasks = [stream.task for stream in conversation_streams.values() if not stream.task.done()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await inference.aclose()
+    await conversation_store.close()
+    if transcript_archive is not None:
+        # Writes what the cancelled conversations recorded last
+        await asyncio.to_thread(transcript_archive.close)
+    if response_cache is not None:
+        response_cache.close()
+
+app = FastAPI(title="AiTalkDual Improved", description="AI Conversation Simulator - Natural Conversations", lifespan=lifespan)
 
 # Add CORS headers manually since fastapi.middleware.cors might not be available
 @app.middleware("http")
@@ -36,16 +86,17 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # Templates
 templates = Jinja2Templates(directory="templates")
 
-# Store active conversations
-active_conversations: Dict[str, dict] = {}
+# Store active conversations (in memory by default, see AITALK_STORE)
+conversation_store = create_store()
 
-class ImprovedConversationConfig(BaseModel):
-    model1: str = "qwen2:1.5b"
-    model2: str = "llama3.2:1b"
-    model1_context: str = """You are an experienced astronaut who has just returned from a mission to the International Space Station. You're feeling excited and want to share your experiences with someone. Start by telling them about the most amazing moment during your recent space mission."""
-    model2_context: str = """You are a curious high school student who is fascinated by space and science. You just met someone who seems to have interesting stories about space. You're eager to learn and ask thoughtful questions about their experiences."""
-    turns: int = 4
-    typing_speed: float = 50.0  # chars per second
+# Conversations that are currently generating, so they can be cancelled
+running_conversations: Dict[str, Conversation] = {}
+
+# Event logs of conversations generated by this worker. A conversation keeps generating while
+# nobody is watching for AITALK_STREAM_IDLE_TIMEOUT seconds, and its log is kept that long
+# after it finishes, so clients can reconnect and resume with Last-Event-ID.
+conversation_streams: Dict[str, EventLog] = {}
+STREAM_IDLE_TIMEOUT = float(os.getenv("AITALK_STREAM_IDLE_TIMEOUT", "30"))
 
 class ChatMessage(BaseModel):
     role: str  # 'model1', 'model2', 'system'
@@ -59,247 +110,252 @@ async def home(request: Request):
     """Serve the main page"""
     return templates.TemplateResponse("index.html", {"request": request})
 
+def server_busy(message: str) -> HTTPException:
+    """429 response for a conversation refused by the turn scheduler"""
+    with metrics.REGISTRY.lock:
+        metrics.scheduler_rejections.inc()
+    return HTTPException(status_code=429, detail=message, headers={"Retry-After": str(BUSY_RETRY_AFTER)})
+
 @app.get("/api/models")
-async def get_available_models():
-    """Get list of available Ollama models"""
-    try:
-        # Get models from Ollama
-        models_response = ollama.list()
-        
-        # Check if we got a valid response
-        if not models_response:
-            return {"models": [], "error": "No models found. Please install models with 'ollama pull model-name'"}
-        
-        # Handle Pydantic response object - it has a 'models' attribute
-        if hasattr(models_response, 'models'):
-            models_array = models_response.models
-        elif isinstance(models_response, dict) and 'models' in models_response:
-            models_array = models_response['models']
-        else:
-            return {"models": [], "error": "No models found. Please install models with 'ollama pull model-name'"}
-        
-        model_list = []
-        
-        for model in models_array:
-            # Handle Pydantic model objects and dicts
-            if hasattr(model, 'model'):
-                # Pydantic object with 'model' attribute
-                name = model.model
-            elif isinstance(model, dict):
-                # Dictionary object
-                name = (model.get('model') or 
-                       model.get('name') or 
-                       model.get('id') or 
-                       'Unknown')
-            elif isinstance(model, str):
-                # String object
-                name = model
-            else:
-                continue
-            
-            model_info = {
-                "name": name,
-                "size": getattr(model, 'size', 0) if hasattr(model, 'size') else (model.get('size', 0) if isinstance(model, dict) else 0),
-                "modified_at": str(getattr(model, 'modified_at', '')) if hasattr(model, 'modified_at') else (model.get('modified_at', '') if isinstance(model, dict) else '')
-            }
-                
-            model_list.append(model_info)
-        
-        # Sort models alphabetically by name
-        model_list.sort(key=lambda x: x['name'])
-        
-        # Extract just the names for the frontend
-        model_names = [model['name'] for model in model_list if model['name'] != 'Unknown']
-        
-        if not model_names:
-            return {"models": [], "error": "No valid models found. Please install models with 'ollama pull model-name'"}
-        
-        return {
-            "models": model_names,
-            "model_details": model_list
-        }
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"Error getting models: {error_msg}")
-        if "connection" in error_msg.lower() or "refused" in error_msg.lower():
-            return {"models": [], "error": "Cannot connect to Ollama service. Please start Ollama with 'ollama serve'"}
-        else:
-            return {"models": [], "error": f"Ollama error: {error_msg}"}
+async def get_available_models(request: Request):
+    """Get list of available Ollama models from the cached catalogue"""
+    payload = await model_registry.payload()
+    headers = {"ETag": model_registry.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == model_registry.etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
 
-async def initialize_model_with_context(model_name: str, context: str):
-    """Initialize a model with its private context"""
-    messages = [{'role': 'system', 'content': context}]
-    
-    # Get the model's natural opening based on their context
-    response = ollama.chat(model=model_name, messages=messages)
-    opening_message = response['message']['content']
+async def render_turn(config: ImprovedConversationConfig, turn: Turn, log: EventLog):
+    """Publish a pipelined turn as stream events while later turns keep generating"""
+    started = False
+    chunk_size = max(1, int(config.typing_speed / 10))
     
-    # Update history to include the opening
-    messages.append({'role': 'assistant', 'content': opening_message})
+    # Streamed tokens are coalesced into one chunk frame per flush interval
+    async for content in turn.pieces(FLUSH_INTERVAL if config.stream_tokens else 0.0):
+        if not started:
+            log.event('message_start', model=turn.model, name=turn.speaker.name, speaker=turn.speaker.index,
+                      turn=turn.number, cached=turn.cached)
+            started = True
+        if config.stream_tokens:
+            # Forward tokens as they arrive; the browser applies the typing effect
+            log.chunk(content)
+        else:
+            # Pace the full reply out with a simulated typing effect
+            for i in range(0, len(content), chunk_size):
+                log.chunk(content[i:i+chunk_size])
+                await asyncio.sleep(chunk_size / config.typing_speed)
     
-    return messages, opening_message
+    if not started:
+        log.event('message_start', model=turn.model, name=turn.speaker.name, speaker=turn.speaker.index,
+                  turn=turn.number, cached=turn.cached)
+    log.event('message_end', model=turn.model)
 
 @app.post("/api/conversation/start")
 async def start_conversation(config: ImprovedConversationConfig):
     """Start a new conversation with improved context isolation"""
     conversation_id = str(uuid.uuid4())
     
-    # Validate models exist
-    try:
-        available_models = ollama.list()
-        if hasattr(available_models, 'models'):
-            available_names = [model.model if hasattr(model, 'model') else str(model) for model in available_models.models]
-        elif isinstance(available_models, dict) and 'models' in available_models:
-            available_names = [model['name'] if isinstance(model, dict) else str(model) for model in available_models['models']]
-        else:
-            available_names = []
-        
-        if config.model1 not in available_names:
-            raise HTTPException(status_code=400, detail=f"Model {config.model1} not found")
-        if config.model2 not in available_names:
-            raise HTTPException(status_code=400, detail=f"Model {config.model2} not found")
-    except Exception as e:
-        logger.error(f"Error validating models: {e}")
-        # Continue anyway, let Ollama handle the error
+    # Refuse early rather than queueing the conversation behind a full scheduler
+    if turn_scheduler.saturated:
+        raise server_busy("Server busy, try again later")
+    
+    if config.participants is not None and len(config.participants) < 2:
+        raise HTTPException(status_code=400, detail="A conversation needs at least two participants")
+    
+    # Validate models against the cached catalogue; if Ollama could not be listed yet,
+    # continue anyway and let Ollama report the error
+    if model_registry.loaded:
+        for model in config.models():
+            if model not in model_registry:
+                # The model may have been pulled since the last refresh
+                model_registry.refresh_soon()
+                raise HTTPException(status_code=400, detail=f"Model {model} not found")
     
     # Store conversation state
-    active_conversations[conversation_id] = {
+    await conversation_store.add(conversation_id, {
         "config": config.dict(),
-        "model1_messages": [],
-        "model2_messages": [],
+        "transcript": [],
         "current_turn": 0,
         "is_running": False,
-        "model1_opening": None
-    }
+        # Set once generation starts, so a stream whose events have expired is never generated again
+        "started": False
+    })
     
     return {"conversation_id": conversation_id}
 
-@app.get("/api/conversation/{conversation_id}/stream")
-async def stream_conversation(conversation_id: str):
-    """Stream the improved conversation using Server-Sent Events"""
-    logger.info(f"Starting improved stream for conversation {conversation_id}")
-    
-    if conversation_id not in active_conversations:
-        logger.error(f"Conversation {conversation_id} not found")
-        raise HTTPException(status_code=404, detail="Conversation not found")
-    
-    conversation = active_conversations[conversation_id]
-    
-    if conversation["is_running"]:
-        logger.warning(f"Conversation {conversation_id} already running")
-        raise HTTPException(status_code=409, detail="Conversation already running")
-    
-    conversation["is_running"] = True
-    
-    async def generate_improved_conversation():
-        try:
-            config = ImprovedConversationConfig(**conversation["config"])
-            
-            yield f"data: {json.dumps({'type': 'start', 'message': 'Initializing models with private contexts...'})}\n\n"
-            
-            # Initialize Model 1 with its private context
-            yield f"data: {json.dumps({'type': 'init', 'model': config.model1, 'message': 'Setting up private context...'})}\n\n"
-            model1_messages, model1_opening = await initialize_model_with_context(config.model1, config.model1_context)
-            conversation["model1_messages"] = model1_messages
-            conversation["model1_opening"] = model1_opening
-            
-            # Initialize Model 2 with its private context  
-            yield f"data: {json.dumps({'type': 'init', 'model': config.model2, 'message': 'Setting up private context...'})}\n\n"
-            model2_messages, _ = await initialize_model_with_context(config.model2, config.model2_context)
-            conversation["model2_messages"] = model2_messages
-            
-            yield f"data: {json.dumps({'type': 'contexts_ready', 'message': 'Both models ready with independent contexts'})}\n\n"
-            
-            # Start with Model 1's opening message
-            yield f"data: {json.dumps({'type': 'message_start', 'model': config.model1, 'turn': 1})}\n\n"
-            
-            # Stream Model 1's opening with typing effect
-            chunk_size = max(1, int(config.typing_speed / 10))
-            for i in range(0, len(model1_opening), chunk_size):
-                chunk = model1_opening[i:i+chunk_size]
-                yield f"data: {json.dumps({'type': 'message_chunk', 'content': chunk, 'model': config.model1})}\n\n"
-                await asyncio.sleep(chunk_size / config.typing_speed)
-            
-            yield f"data: {json.dumps({'type': 'message_end', 'model': config.model1})}\n\n"
+async def run_conversation(conversation_id: str, conversation: dict, log: EventLog):
+    """Generate the conversation in the background, publishing its events to the log"""
+    dialogue = None
+    status = "cancelled"
+    try:
+        config = ImprovedConversationConfig(**conversation["config"])
+        # Every model call waits its turn in the scheduler; waiting viewers see their queue position
+        client = ScheduledClient(inference, turn_scheduler, conversation_id,
+                                 on_wait=lambda position, model: log.event('queued', position=position, model=model))
+        
+        log.event('start', message='Initializing models with private contexts...')
+        
+        # Each participant keeps only its private context and hears the others' replies as if
+        # from human conversation partners. The other models load while the first one opens.
+        dialogue = Conversation.from_config(client, config, preload=True)
+        for participant in dialogue.participants:
+            log.event('init', model=participant.model, name=participant.name, message='Setting up private context...')
+        # Replies are stored once, in the transcript the store saves
+        conversation["transcript"] = dialogue.transcript.entries
+        if transcript_archive is not None:
+            transcript_archive.start_conversation(
+                conversation_id, conversation["config"],
+                [{"name": participant.name, "model": participant.model} for participant in dialogue.participants])
+        
+        log.event('contexts_ready', message='All models ready with independent contexts')
+        
+        # The next reply is generated while the current one is still being rendered
+        running_conversations[conversation_id] = dialogue
+        dialogue.start()
+        
+        async for turn in dialogue:
+            if turn.index > 0:
+                await asyncio.sleep(1)
+                log.event('thinking', model=turn.model, name=turn.speaker.name, speaker=turn.speaker.index,
+                          turn=turn.number)
+            conversation["current_turn"] = (turn.index + len(dialogue.participants) - 1) // len(dialogue.participants)
             
-            # This becomes the input for Model 2 (as if from a human)
-            current_prompt = model1_opening
+            try:
+                await render_turn(config, turn, log)
+            except Exception as e:
+                logger.error(f"Error with {turn.model}: {e}")
+                log.event('error', message=f'Error with {turn.model}: {str(e)}')
+                status = "error"
+                break
             
-            # Continue the conversation
-            for turn in range(config.turns):
-                conversation["current_turn"] = turn + 1
-                await asyncio.sleep(1)
-                
-                # Model 2's turn
-                yield f"data: {json.dumps({'type': 'thinking', 'model': config.model2, 'turn': turn + 1})}\n\n"
-                
-                try:
-                    # Model 2 receives message as if from a human conversation partner
-                    conversation["model2_messages"].append({'role': 'user', 'content': current_prompt})
-                    
-                    response_2 = ollama.chat(model=config.model2, messages=conversation["model2_messages"])
-                    response_2_content = response_2['message']['content']
-                    
-                    conversation["model2_messages"].append({'role': 'assistant', 'content': response_2_content})
-                    
-                    # Stream Model 2's response
-                    yield f"data: {json.dumps({'type': 'message_start', 'model': config.model2, 'turn': turn + 1})}\n\n"
-                    
-                    for i in range(0, len(response_2_content), chunk_size):
-                        chunk = response_2_content[i:i+chunk_size]
-                        yield f"data: {json.dumps({'type': 'message_chunk', 'content': chunk, 'model': config.model2})}\n\n"
-                        await asyncio.sleep(chunk_size / config.typing_speed)
-                    
-                    yield f"data: {json.dumps({'type': 'message_end', 'model': config.model2})}\n\n"
-                    
-                    current_prompt = response_2_content
-                    await asyncio.sleep(1)
-                    
-                except Exception as e:
-                    logger.error(f"Error with model 2: {e}")
-                    yield f"data: {json.dumps({'type': 'error', 'message': f'Error with {config.model2}: {str(e)}'})}\n\n"
-                    break
-                
-                if turn < config.turns - 1:  # Don't do Model 1's turn on the last iteration
-                    # Model 1's turn
-                    yield f"data: {json.dumps({'type': 'thinking', 'model': config.model1, 'turn': turn + 1})}\n\n"
-                    
-                    try:
-                        # Model 1 receives message as if from a human conversation partner
-                        conversation["model1_messages"].append({'role': 'user', 'content': current_prompt})
-                        
-                        response_1 = ollama.chat(model=config.model1, messages=conversation["model1_messages"])
-                        response_1_content = response_1['message']['content']
-                        
-                        conversation["model1_messages"].append({'role': 'assistant', 'content': response_1_content})
-                        
-                        # Stream Model 1's response
-                        yield f"data: {json.dumps({'type': 'message_start', 'model': config.model1, 'turn': turn + 2})}\n\n"
-                        
-                        for i in range(0, len(response_1_content), chunk_size):
-                            chunk = response_1_content[i:i+chunk_size]
-                            yield f"data: {json.dumps({'type': 'message_chunk', 'content': chunk, 'model': config.model1})}\n\n"
-                            await asyncio.sleep(chunk_size / config.typing_speed)
-                        
-                        yield f"data: {json.dumps({'type': 'message_end', 'model': config.model1})}\n\n"
-                        
-                        current_prompt = response_1_content
-                        await asyncio.sleep(1)
-                        
-                    except Exception as e:
-                        logger.error(f"Error with model 1: {e}")
-                        yield f"data: {json.dumps({'type': 'error', 'message': f'Error with {config.model1}: {str(e)}'})}\n\n"
-                        break
+            if transcript_archive is not None:
+                transcript_archive.add_turn(conversation_id, turn.index, turn.number, turn.speaker.index,
+                                            turn.speaker.name, turn.model, turn.content, turn.timing.as_dict())
             
-            yield f"data: {json.dumps({'type': 'complete', 'message': 'Natural conversation completed - models never knew they were talking to AI!'})}\n\n"
+            if dialogue.cancelled:
+                break
             
+            # Persist progress; the conversation may have been deleted by another worker
+            if not await conversation_store.update(conversation_id, conversation):
+                dialogue.cancel()
+                break
+        
+        if dialogue.cancelled:
+            log.event('cancelled', message='Conversation stopped')
+        elif status != "error":
+            # After an error the error event is the last one
+            status = "completed"
+            timing = dialogue.timing_summary()
+            logger.info(f"Conversation {conversation_id} ({' / '.join(config.models())}) finished in "
+                        f"{timing['wall_s']:.1f}s: " + ", ".join(
+                            f"{model} {stats['completion_tokens']} tokens at {stats['eval_tokens_per_s']} tokens/s"
+                            for model, stats in timing['models'].items()))
+            log.event('complete', message='Natural conversation completed - models never knew they were talking to AI!',
+                      timing=timing)
+        
+    except asyncio.CancelledError:
+        logger.info(f"Conversation {conversation_id} cancelled")
+        # A final event, so viewers stop reconnecting
+        log.event('cancelled', message='Conversation stopped')
+    except Exception as e:
+        logger.error(f"Conversation error: {e}")
+        log.event('error', message=str(e))
+        status = "error"
+    finally:
+        log.close()
+        if dialogue is not None:
+            if transcript_archive is not None:
+                transcript_archive.end_conversation(conversation_id, status, dialogue.timing_summary())
+            dialogue.cancel()
+            if running_conversations.get(conversation_id) is dialogue:
+                del running_conversations[conversation_id]
+        conversation["is_running"] = False
+        try:
+            # Shielded so the save completes even while the task is being cancelled
+            await asyncio.shield(conversation_store.update(conversation_id, conversation))
         except Exception as e:
-            logger.error(f"Conversation error: {e}")
-            yield f"data: {json.dumps({'type': 'error', 'message': str(e)})}\n\n"
-        finally:
-            conversation["is_running"] = False
+            logger.error(f"Error saving conversation {conversation_id}: {e}")
+        # Keep the log around for clients that reconnect after the end
+        asyncio.get_running_loop().call_later(STREAM_IDLE_TIMEOUT, forget_stream, conversation_id, log)
+
+def forget_stream(conversation_id: str, log: EventLog):
+    if conversation_streams.get(conversation_id) is log:
+        del conversation_streams[conversation_id]
+
+def cancel_if_unwatched(log: EventLog):
+    """Stop generating a conversation nobody has watched for the idle timeout"""
+    log.idle_timer = None
+    if log.subscribers == 0 and not log.closed:
+        log.task.cancel()
+
+async def follow_stream(log: EventLog, encoder: EventEncoder, after: int):
+    """Send one viewer the events after `after`, then live events until the conversation ends"""
+    try:
+        async for event_id, data, chunk in log.subscribe(after):
+            yield encoder.frame(data, chunk, event_id)
+    finally:
+        if log.subscribers == 0 and not log.closed:
+            # Counted from the last viewer leaving
+            if log.idle_timer is not None:
+                log.idle_timer.cancel()
+            log.idle_timer = asyncio.get_running_loop().call_later(STREAM_IDLE_TIMEOUT, cancel_if_unwatched, log)
+
+@app.get("/api/conversation/{conversation_id}/stream")
+async def stream_conversation(conversation_id: str, request: Request, format: str = "sse",
+                              last_event_id: Optional[int] = None):
+    """Stream the improved conversation using Server-Sent Events, or NDJSON with ?format=ndjson
+
+    Reconnecting clients resume after the Last-Event-ID header (or ?last_event_id=), and any
+    number of viewers can follow a running conversation without generating it again.
+    """
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported stream format: {format}")
+    encoder = EventEncoder(format)
+    if last_event_id is None:
+        try:
+            last_event_id = int(request.headers.get("last-event-id") or 0)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Last-Event-ID")
     
-    return StreamingResponse(generate_improved_conversation(), media_type="text/event-stream", headers={
+    log = conversation_streams.get(conversation_id)
+    if log is None:
+        conversation = await conversation_store.get(conversation_id)
+        if conversation is None:
+            logger.error(f"Conversation {conversation_id} not found")
+            raise HTTPException(status_code=404, detail="Conversation not found")
+        
+        # Another request may have started it while the store was being read
+        log = conversation_streams.get(conversation_id)
+        if log is None:
+            if conversation["is_running"]:
+                # Generated by another worker; resuming needs sticky sessions
+                logger.warning(f"Conversation {conversation_id} already running")
+                raise HTTPException(status_code=409, detail="Conversation already running")
+            if conversation.get("started") or last_event_id > 0:
+                # Its events have expired; 204 tells EventSource to stop reconnecting
+                logger.info(f"Conversation {conversation_id} already finished, not generating it again")
+                return Response(status_code=204)
+            
+            # Reserve a queue place for every call the conversation can have in flight
+            places = ImprovedConversationConfig(**conversation["config"]).max_parallel_calls()
+            try:
+                turn_scheduler.open_conversation(places)
+            except SchedulerFull as e:
+                logger.warning(f"Conversation {conversation_id} refused: {e}")
+                raise server_busy(str(e))
+            logger.info(f"Starting improved stream for conversation {conversation_id}")
+            log = conversation_streams[conversation_id] = EventLog()
+            conversation["is_running"] = True
+            conversation["started"] = True
+            log.task = asyncio.create_task(run_conversation(conversation_id, conversation, log))
+            # A done callback also runs when the task is cancelled before it starts
+            log.task.add_done_callback(lambda task: turn_scheduler.close_conversation(places))
+            await conversation_store.update(conversation_id, conversation)
+            last_event_id = 0
+    else:
+        logger.info(f"Resuming stream for conversation {conversation_id} after event {last_event_id}")
+    
+    return StreamingResponse(follow_stream(log, encoder, last_event_id), media_type=encoder.media_type, headers={
         "Cache-Control": "no-cache",
         "Connection": "keep-alive",
         "Access-Control-Allow-Origin": "*",
@@ -309,25 +365,119 @@ async def stream_conversation(conversation_id: str):
 @app.delete("/api/conversation/{conversation_id}")
 async def stop_conversation(conversation_id: str):
     """Stop and delete a conversation"""
-    if conversation_id in active_conversations:
-        active_conversations[conversation_id]["is_running"] = False
-        del active_conversations[conversation_id]
+    dialogue = running_conversations.pop(conversation_id, None)
+    if dialogue is not None:
+        dialogue.cancel()
+    stream = conversation_streams.get(conversation_id)
+    if stream is not None and not stream.task.done():
+        stream.task.cancel()
+    # A stream running in another worker stops at its next turn once the conversation is gone
+    if await conversation_store.delete(conversation_id) or dialogue is not None:
         return {"message": "Conversation stopped"}
     raise HTTPException(status_code=404, detail="Conversation not found")
 
 @app.get("/api/conversation/{conversation_id}/status")
 async def get_conversation_status(conversation_id: str):
     """Get the current status of a conversation"""
-    if conversation_id not in active_conversations:
+    conversation = await conversation_store.get(conversation_id)
+    if conversation is None:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    conversation = active_conversations[conversation_id]
     return {
         "is_running": conversation["is_running"],
         "current_turn": conversation["current_turn"],
         "total_turns": conversation["config"]["turns"]
     }
 
+def archive_or_404():
+    if transcript_archive is None:
+        raise HTTPException(status_code=404, detail="Transcript archive is off (set AITALK_ARCHIVE)")
+    return transcript_archive
+
+async def flush_archive(archive):
+    """Write out buffered records before an export; on failure serve what is already indexed"""
+    try:
+        await asyncio.to_thread(archive.flush)
+    except Exception as e:
+        logger.error(f"Error flushing the transcript archive before an export: {e}")
+
+@app.get("/api/conversations")
+async def list_archived_conversations(before: Optional[int] = None, limit: int = 50):
+    """Archived conversations, newest first; pass `next` as ?before= for the following page"""
+    archive = archive_or_404()
+    limit = max(1, min(limit, 500))
+    conversations = await asyncio.to_thread(archive.list_conversations, before, limit)
+    return {"conversations": conversations,
+            "next": conversations[-1]["seq"] if len(conversations) == limit else None}
+
+@app.get("/api/conversations/search")
+async def search_archived_conversations(q: str, limit: int = 20):
+    """Archived turns containing every word of the query, best matches first"""
+    archive = archive_or_404()
+    return {"results": await asyncio.to_thread(archive.search, q, max(1, min(limit, 200)))}
+
+@app.get("/api/conversations/export")
+async def export_archive():
+    """Every archived record as JSON lines, streamed from the log"""
+    archive = archive_or_404()
+    await flush_archive(archive)
+    # Starlette iterates plain generators in a worker thread, so reading the log never blocks the loop
+    return StreamingResponse(archive.iter_log(), media_type="application/x-ndjson")
+
+@app.get("/api/conversations/{conversation_id}/transcript")
+async def export_transcript(conversation_id: str):
+    """One conversation as JSON lines: a summary line followed by one line per turn"""
+    archive = archive_or_404()
+    # Include the turns of a running conversation that are still buffered
+    await flush_archive(archive)
+    summary = await asyncio.to_thread(archive.get_conversation, conversation_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Conversation not found in the archive")
+    
+    def lines():
+        yield json.dumps(dict(summary, type="conversation"), ensure_ascii=False).encode() + b"\n"
+        yield from archive.iter_turns(conversation_id)
+    
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={
+        "Content-Disposition": f'attachment; filename="{conversation_id}.jsonl"'})
+
+@app.get("/api/store/stats")
+async def get_store_stats():
+    """Get conversation store size and eviction counters"""
+    return await conversation_store.stats()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-model latency, token throughput and conversation store counters"""
+    store = metrics.Gauge("aitalk_conversation_store", "Conversation store size and eviction counters")
+    for key, value in (await conversation_store.stats()).items():
+        store.set(value, stat=key)
+    running = metrics.Gauge("aitalk_conversations_streaming", "Conversations streaming in this worker")
+    running.set(len(running_conversations))
+    viewers = metrics.Gauge("aitalk_stream_viewers", "Clients following a conversation stream in this worker")
+    viewers.set(sum(stream.subscribers for stream in conversation_streams.values()))
+    backends = metrics.Gauge("aitalk_backend_outstanding", "Model calls running or queued per Ollama backend")
+    health = metrics.Gauge("aitalk_backend_healthy", "Whether an Ollama backend is currently in rotation")
+    for backend in inference.backends:
+        backends.set(backend.outstanding, backend=backend.name)
+        health.set(int(backend.healthy), backend=backend.name)
+    scheduler = metrics.Gauge("aitalk_scheduler", "Model calls running and waiting in the turn scheduler, reserved queue places and admitted conversations")
+    for key, value in turn_scheduler.stats().items():
+        scheduler.set(value, stat=key)
+    extra = [store, running, viewers, backends, health, scheduler]
+    if transcript_archive is not None:
+        archive = metrics.Gauge("aitalk_transcript_archive", "Archived conversations, turns and log size")
+        for key, value in (await asyncio.to_thread(transcript_archive.stats)).items():
+            archive.set(value, stat=key)
+        extra.append(archive)
+    if response_cache is not None:
+        cache = metrics.Gauge("aitalk_response_cache", "Response cache size and hit rate")
+        for key, value in (await asyncio.to_thread(response_cache.stats)).items():
+            cache.set(value, stat=key)
+        extra.append(cache)
+    return PlainTextResponse(metrics.REGISTRY.render(extra=extra),
+                             media_type="text/plain; version=0.0.4")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file